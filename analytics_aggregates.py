@@ -0,0 +1,169 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from delta_log import read_movies
+from metrics import stage_timer
+from ratings_store import RatingsStore, load_ratings, store_is_current
+
+ANALYTICS_DIR = 'data/analytics'
+RATING_LEVELS = np.arange(1, 11) / 2
+MIN_RATINGS_FOR_TOP = 10
+TOP_N = 10
+
+
+def _rating_columns():
+    # Ratings as (movieId, rating * 2) arrays; the columnar store already holds half-star bytes
+    if store_is_current():
+        columns = RatingsStore().columns(['movieId', 'rating_x2', 'userId'])
+        return columns['movieId'], columns['rating_x2'], columns['userId']
+    ratings = load_ratings(['userId', 'movieId', 'rating'])
+    return (
+        ratings['movieId'].to_numpy(np.int32),
+        np.rint(ratings['rating'].to_numpy() * 2).astype(np.uint8),
+        ratings['userId'].to_numpy(np.int32),
+    )
+
+
+def _hist_cells(catalog_ids, movie_ids, ratings_x2):
+    # Map each rating to its catalog row and rating level; ratings for unknown movies are dropped
+    order = np.argsort(catalog_ids)
+    sorted_ids = catalog_ids[order]
+    pos = np.clip(np.searchsorted(sorted_ids, movie_ids), 0, len(sorted_ids) - 1)
+    known = sorted_ids[pos] == movie_ids
+    return order[pos[known]], ratings_x2[known].astype(np.int64) - 1
+
+
+def _rating_summary(rating_hist):
+    rating_count = rating_hist.sum(axis=1)
+    rating_sum = rating_hist @ RATING_LEVELS
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_rating = np.where(rating_count > 0, rating_sum / rating_count, np.nan)
+    return rating_count, avg_rating.astype(np.float32)
+
+
+def _movie_stats(movies, rating_hist):
+    rating_count, avg_rating = _rating_summary(rating_hist)
+    return pd.DataFrame({
+        'movieId': movies['movieId'].to_numpy(np.int32),
+        'title': movies['title'].to_numpy(),
+        'year': pd.to_numeric(movies['title'].str.extract(r'\((\d{4})\)')[0], errors='coerce').to_numpy(),
+        'genres': movies['genres'].fillna('').to_numpy(),
+        'rating_count': rating_count,
+        'avg_rating': avg_rating,
+    })
+
+
+def _write_aggregates(movie_stats, rating_hist, totals, out_dir):
+    movie_stats.to_pickle(os.path.join(out_dir, 'movie_stats.pkl'))
+    np.save(os.path.join(out_dir, 'rating_hist.npy'), rating_hist)
+
+    # Genre x release-year rating counts for the trend chart
+    exploded = movie_stats.dropna(subset=['year']).assign(genre=lambda df: df['genres'].str.split('|')).explode('genre')
+    genre_year_counts = exploded.groupby(['year', 'genre'])['rating_count'].sum().reset_index(name='count')
+    genre_year_counts = genre_year_counts[genre_year_counts['count'] > 0]
+    genre_year_counts.to_pickle(os.path.join(out_dir, 'genre_year_counts.pkl'))
+
+    exploded = movie_stats.assign(genre=movie_stats['genres'].str.split('|')).explode('genre')
+    exploded = exploded[(exploded['genre'] != '') & (exploded['genre'].str.lower() != '(no genres listed)')]
+    genres = sorted(exploded['genre'].unique())
+    eligible = exploded[exploded['rating_count'] >= MIN_RATINGS_FOR_TOP]
+    genre_top = (
+        eligible.sort_values('avg_rating', ascending=False)
+        .groupby('genre').head(TOP_N)[['genre', 'movieId', 'title', 'avg_rating', 'rating_count']]
+        .reset_index(drop=True)
+    )
+    genre_top.to_pickle(os.path.join(out_dir, 'genre_top.pkl'))
+
+    summary = {
+        'total_movies': int(movie_stats['movieId'].nunique()),
+        'total_users': totals['users'],
+        'total_ratings': totals['ratings'],
+        'avg_ratings_per_movie': float(totals['ratings'] / max(1, totals['rated_movies'])),
+        'genres': genres,
+    }
+    with open(os.path.join(out_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f)
+
+
+def build_analytics_aggregates(out_dir=ANALYTICS_DIR):
+    os.makedirs(out_dir, exist_ok=True)
+    movies = read_movies()
+    movie_ids, ratings_x2, user_ids = _rating_columns()
+
+    n_movies = len(movies)
+    rows, levels = _hist_cells(movies['movieId'].to_numpy(), movie_ids, ratings_x2)
+    rating_hist = np.bincount(rows * len(RATING_LEVELS) + levels, minlength=n_movies * len(RATING_LEVELS))
+    rating_hist = rating_hist.reshape(n_movies, len(RATING_LEVELS)).astype(np.uint32)
+
+    totals = {
+        'users': int(len(np.unique(user_ids))),
+        'ratings': int(len(movie_ids)),
+        'rated_movies': int(len(np.unique(movie_ids))),
+    }
+    _write_aggregates(_movie_stats(movies, rating_hist), rating_hist, totals, out_dir)
+    print(f"Analytics aggregates for {n_movies} movies saved to {out_dir}.")
+
+
+def update_analytics_aggregates(added, removed=None, new_movies=None, out_dir=ANALYTICS_DIR):
+    # Incremental counterpart of build_analytics_aggregates: added/removed are (movieId, rating_x2)
+    # arrays, new_movies has movies.csv columns. Only the touched histogram rows are recomputed.
+    movie_stats = pd.read_pickle(os.path.join(out_dir, 'movie_stats.pkl'))
+    rating_hist = np.load(os.path.join(out_dir, 'rating_hist.npy'))
+    if new_movies is not None and len(new_movies):
+        new_movies = new_movies[~new_movies['movieId'].isin(movie_stats['movieId'])]
+        new_hist = np.zeros((len(new_movies), len(RATING_LEVELS)), dtype=rating_hist.dtype)
+        movie_stats = pd.concat([movie_stats, _movie_stats(new_movies, new_hist)], ignore_index=True)
+        rating_hist = np.concatenate([rating_hist, new_hist])
+
+    catalog_ids = movie_stats['movieId'].to_numpy()
+    hist = rating_hist.astype(np.int64)
+    touched = []
+    for cells, sign in ((added, 1), (removed, -1)):
+        if cells is None or not len(cells[0]):
+            continue
+        rows, levels = _hist_cells(catalog_ids, *cells)
+        np.add.at(hist, (rows, levels), sign)
+        touched.append(rows)
+    rating_hist = hist.astype(rating_hist.dtype)
+    if touched:
+        touched = np.unique(np.concatenate(touched))
+        rating_count, avg_rating = _rating_summary(rating_hist[touched])
+        movie_stats.loc[touched, 'rating_count'] = rating_count
+        movie_stats.loc[touched, 'avg_rating'] = avg_rating
+
+    if store_is_current():
+        store = RatingsStore()
+        totals = {
+            'users': len(store.unique('userId')),
+            'ratings': len(store),
+            'rated_movies': len(store.unique('movieId')),
+        }
+    else:
+        movie_ids, _, user_ids = _rating_columns()
+        totals = {
+            'users': int(len(np.unique(user_ids))),
+            'ratings': int(len(movie_ids)),
+            'rated_movies': int(len(np.unique(movie_ids))),
+        }
+    _write_aggregates(movie_stats, rating_hist, totals, out_dir)
+    print(f"Analytics aggregates updated: {len(touched)} movies changed, {len(movie_stats)} in total.")
+
+
+def load_analytics_aggregates(path=ANALYTICS_DIR):
+    with open(os.path.join(path, 'summary.json')) as f:
+        summary = json.load(f)
+    return {
+        'summary': summary,
+        'movie_stats': pd.read_pickle(os.path.join(path, 'movie_stats.pkl')),
+        'rating_hist': np.load(os.path.join(path, 'rating_hist.npy'), mmap_mode='r'),
+        'genre_year_counts': pd.read_pickle(os.path.join(path, 'genre_year_counts.pkl')),
+        'genre_top': pd.read_pickle(os.path.join(path, 'genre_top.pkl')),
+    }
+
+
+if __name__ == "__main__":
+    with stage_timer('analytics', 'build_aggregates'):
+        build_analytics_aggregates()
@@ -0,0 +1,48 @@
+import argparse
+import time
+import joblib
+import numpy as np
+
+from ann_index import IVFIndex
+from similarity import SimilarityEngine
+
+
+def run_benchmark(k=10, n_queries=500, nprobes=(1, 2, 4, 8, 16, 32, 64), random_state=0):
+    content_embeddings = joblib.load('models/content_embeddings.pkl')
+    engine = SimilarityEngine(content_embeddings)
+    index = IVFIndex.load('models/ann_index.npz')
+
+    rng = np.random.default_rng(random_state)
+    queries = rng.choice(len(engine), min(n_queries, len(engine)), replace=False)
+
+    start = time.perf_counter()
+    exact = [engine.most_similar(row, k) for row in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    # With ties in the exact scores, recall is measured against the k-th best score rather than ids
+    thresholds = [scores[0][-1] for _, scores in exact]
+
+    print(f"Catalog size: {len(engine)}, index lists: {index.n_lists}, k={k}, queries={len(queries)}")
+    print(f"{'mode':>12} {'recall@k':>10} {'mean ms':>10} {'p95 ms':>10}")
+    print(f"{'exact':>12} {1.0:>10.4f} {exact_ms:>10.3f} {'':>10}")
+
+    for nprobe in nprobes:
+        if nprobe > index.n_lists:
+            break
+        latencies = []
+        recalls = []
+        for row, threshold in zip(queries, thresholds):
+            start = time.perf_counter()
+            _, scores = index.search(engine.normalized[row], k, nprobe=nprobe, exclude=row)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(np.sum(scores >= threshold - 1e-6) / k)
+        latencies = np.array(latencies)
+        print(f"{'nprobe=' + str(nprobe):>12} {np.mean(np.minimum(recalls, 1.0)):>10.4f} "
+              f"{latencies.mean():>10.3f} {np.percentile(latencies, 95):>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k vs. latency of the ANN index against exact search")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+    run_benchmark(k=args.k, n_queries=args.queries)
@@ -0,0 +1,108 @@
+import numpy as np
+
+from metrics import timed
+from similarity import l2_normalize, top_k
+
+
+def _assign(vectors, centroids, block_size=8192):
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        labels[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=20, random_state=42):
+    rng = np.random.default_rng(random_state)
+    n_clusters = max(1, min(n_clusters, len(vectors)))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    labels = _assign(vectors, centroids)
+    for _ in range(n_iter):
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=n_clusters)
+        # Re-seed empty clusters from random points so every list stays usable
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = l2_normalize(sums)
+        new_labels = _assign(vectors, centroids)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return centroids, labels
+
+
+# Inverted-file index over L2-normalized vectors using k-means centroids.
+# Vectors are stored grouped by list so probing a list is one contiguous slice.
+class IVFIndex:
+    def __init__(self, centroids, list_offsets, list_items, list_vectors):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_items = list_items
+        self.list_vectors = list_vectors
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, normalized, n_lists=None, n_iter=20, random_state=42):
+        normalized = np.asarray(normalized, dtype=np.float32)
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(normalized)))
+        centroids, labels = spherical_kmeans(normalized, n_lists, n_iter, random_state)
+        order = np.argsort(labels, kind='stable').astype(np.int32)
+        counts = np.bincount(labels, minlength=len(centroids))
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, list_offsets, order, normalized[order])
+
+    def add(self, normalized, items):
+        # Append vectors to their nearest existing list without re-clustering; a full build
+        # rebalances the lists once enough new items have accumulated
+        normalized = np.asarray(normalized, dtype=np.float32)
+        labels = _assign(normalized, self.centroids)
+        old_labels = np.repeat(np.arange(self.n_lists, dtype=np.int32), np.diff(self.list_offsets))
+        all_labels = np.concatenate([old_labels, labels])
+        order = np.argsort(all_labels, kind='stable')
+        counts = np.bincount(all_labels, minlength=self.n_lists)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        list_items = np.concatenate([self.list_items, np.asarray(items, dtype=self.list_items.dtype)])[order]
+        list_vectors = np.concatenate([self.list_vectors, normalized])[order]
+        return IVFIndex(self.centroids, list_offsets, list_items, list_vectors)
+
+    def save(self, path):
+        np.savez(
+            path,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_items=self.list_items,
+            list_vectors=self.list_vectors,
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['centroids'], data['list_offsets'], data['list_items'], data['list_vectors'])
+
+    def _candidates(self, query, nprobe):
+        probes = top_k(query @ self.centroids.T, nprobe)
+        positions = np.concatenate([
+            np.arange(self.list_offsets[p], self.list_offsets[p + 1]) for p in probes
+        ])
+        return positions
+
+    def search(self, query, k, nprobe=8, exclude=None, timings=None, mask=None):
+        # nprobe trades recall for latency: more probed lists, more candidates scored
+        query = np.asarray(query, dtype=np.float32)
+        with timed(timings, "score"):
+            positions = self._candidates(query, max(1, min(nprobe, self.n_lists)))
+            items = self.list_items[positions]
+            scores = self.list_vectors[positions] @ query
+            if exclude is not None:
+                scores[items == exclude] = -np.inf
+            if mask is not None:
+                scores[~mask[items]] = -np.inf
+        with timed(timings, "topk"):
+            best = top_k(scores, k)
+            return items[best], scores[best]
@@ -1,54 +1,414 @@
 from fastapi import FastAPI, Query
-import pandas as pd
-import joblib
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import Optional
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Optional
 import traceback
-import numpy as np
+import threading
+import time
+import os
+
+from artifact_store import ArtifactError, current_version
+from batching import MicroBatcher
+from metrics import MetricsRegistry, sample_stacks, timed
+from result_cache import InMemorySharedBackend, LRUCache, ResultCache
+from serving import ServingState, load_state
 
 app = FastAPI()
 
-movies = pd.read_pickle('data/enriched_movies.pkl')
-content_embeddings = joblib.load('models/content_embeddings.pkl')
-movies['title'] = movies['title'].str.lower().str.strip()
+# Current model version. Handlers read this once per request; reloads replace it wholesale.
+state = load_state()
+reload_lock = threading.Lock()
+
+
+class BatchUserRecommendRequest(BaseModel):
+    user_ids: List[int]
+    n: int = 10
+    genre: Optional[str] = None
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    exclude_ids: List[int] = []
+
+
+# Longer title lists are rejected with a 422 before any lookup or scoring happens
+MAX_BATCH_TITLES = int(os.environ.get('MAX_BATCH_TITLES', 1000))
+
+
+class BatchRecommendRequest(BaseModel):
+    titles: List[str] = Field(max_length=MAX_BATCH_TITLES)
+    n: int = 10
+    mode: str = "ann"
+    nprobe: Optional[int] = None
+    genre: Optional[str] = None
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    exclude_ids: List[int] = []
+
+
+def resolve_filters(current, genre=None, year_min=None, year_max=None, exclude_ids=None):
+    # (mask over catalog rows or None, hashable form of the filters for cache keys).
+    # Raises KeyError for a genre the catalog does not have.
+    mask = current.filter_mask(genre, year_min, year_max, exclude_ids)
+    key = (genre.strip().lower() if genre else None, year_min, year_max, tuple(sorted(set(exclude_ids or ()))))
+    return mask, key
+
+
+def reload_state(version=None):
+    global state
+    with reload_lock:
+        if version is None:
+            version = current_version()
+        if version is None or version == state.version:
+            return False
+        # Build the new state fully before publishing it; in-flight requests keep the old one
+        state = ServingState.from_artifacts(version, verify_checksums=True)
+        return True
+
+
+def watch_artifacts(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            if reload_state():
+                print(f"Switched to artifact version {state.version}")
+        except Exception as e:
+            print("Exception while reloading artifacts:", e)
+            traceback.print_exc()
+
+
+# Opt-in polling of models/artifacts/CURRENT so newly published versions are picked up without a restart
+if float(os.environ.get('ARTIFACT_WATCH_SECONDS', 0)) > 0:
+    threading.Thread(target=watch_artifacts, args=(float(os.environ['ARTIFACT_WATCH_SECONDS']),), daemon=True).start()
+
+
+def score_batch(items):
+    # One matmul for every queued (state, row, n) lookup, then each caller gets its own slice,
+    # already built into response entries so nothing CPU-bound is left for the event loop.
+    # Lookups queued across a reload are grouped by the state they were resolved against.
+    results = [None] * len(items)
+    groups = {}
+    for i, (item_state, row, n) in enumerate(items):
+        groups.setdefault(id(item_state), (item_state, []))[1].append(i)
+    for item_state, positions in groups.values():
+        rows = [items[i][1] for i in positions]
+        max_n = max(items[i][2] for i in positions)
+        indices, scores = item_state.engine.most_similar(rows, max_n)
+        for j, i in enumerate(positions):
+            n = max(items[i][2], 0)
+            results[i] = item_state.build_recommendations(indices[j, :n], scores[j, :n])
+    return results
+
+
+# Response cache keyed by model version; RESULT_CACHE_SIZE=0 turns it off
+result_cache = ResultCache(
+    LRUCache(
+        max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 10000)),
+        ttl_seconds=float(os.environ.get('RESULT_CACHE_TTL', 300)),
+    ),
+    shared=InMemorySharedBackend() if os.environ.get('RESULT_CACHE_SHARED', '0') == '1' else None,
+    min_depth=int(os.environ.get('RESULT_CACHE_MIN_N', 20)),
+)
+
+
+# Opt-in micro-batching of live scoring for concurrent /recommend/ calls. It only coalesces full
+# exact scans: unfiltered requests in exact mode, or without an ANN index, that are deeper than
+# the neighbour table. With the default neighbour table plus ANN index those requests are table
+# lookups or per-seed probes with no shared matmul, so the batcher stays idle there.
+if os.environ.get('RECOMMEND_BATCHING', '0') == '1':
+    batcher = MicroBatcher(
+        score_batch,
+        max_batch_size=int(os.environ.get('MICROBATCH_MAX_SIZE', 64)),
+        max_wait_ms=float(os.environ.get('MICROBATCH_MAX_WAIT_MS', 2.0)),
+    )
+else:
+    batcher = None
+
+
+metrics = MetricsRegistry()
+metrics.describe('recommender_requests_total', "Requests by endpoint and outcome (ok, not_found, bad_request, error)")
+metrics.describe('recommender_request_seconds', "End-to-end handler latency")
+metrics.describe('recommender_stage_seconds', "Time spent per request stage (lookup, cache, score, topk, neighbour_table, build)")
+
+
+def collect_component_stats():
+    cache = result_cache.stats()
+    yield 'recommender_cache_lookups_total', 'counter', {'result': 'hit'}, cache['hits']
+    yield 'recommender_cache_lookups_total', 'counter', {'result': 'miss'}, cache['misses']
+    yield 'recommender_cache_shared_hits_total', 'counter', {}, cache['shared_hits']
+    yield 'recommender_cache_evictions_total', 'counter', {'reason': 'capacity'}, cache['evictions']
+    yield 'recommender_cache_evictions_total', 'counter', {'reason': 'ttl'}, cache['expirations']
+    yield 'recommender_cache_entries', 'gauge', {}, cache['entries']
+    if batcher is not None:
+        batching = batcher.stats()
+        yield 'recommender_batcher_queue_depth', 'gauge', {}, batching['queue_depth']
+        yield 'recommender_batcher_batches_total', 'counter', {}, batching['batches']
+        yield 'recommender_batcher_items_total', 'counter', {}, batching['items']
+    yield 'recommender_model_info', 'gauge', {'version': state.version}, 1
+
+
+metrics.add_collector(collect_component_stats)
+
+
+def record_request(endpoint, status, start, timings):
+    metrics.inc('recommender_requests_total', endpoint=endpoint, status=status)
+    metrics.observe('recommender_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+    for stage, seconds in timings.items():
+        metrics.observe('recommender_stage_seconds', seconds, endpoint=endpoint, stage=stage)
+
+
+def lookup_recommend(current, title, n, mode, nprobe, genre, year_min, year_max, exclude_ids, timings):
+    # Validation, filters, title lookup and the cache check for /recommend/. Returns
+    # (status, response) when the request is answered here, else (status, (row, mask, cache_key)).
+    if mode not in ("ann", "exact"):
+        return "bad_request", {"recommendations": [], "error": "mode must be 'ann' or 'exact'."}
+    try:
+        mask, filter_key = resolve_filters(current, genre, year_min, year_max, exclude_ids)
+    except KeyError:
+        return "bad_request", {"recommendations": [], "error": f"Unknown genre '{genre}'."}
+    with timed(timings, "lookup"):
+        row_pos = current.find_movie_row(title)
+    if row_pos is None:
+        return "not_found", {"recommendations": [], "error": "Movie not found."}
+
+    cache_key = (current.version, "movie", row_pos, mode, nprobe, filter_key)
+    with timed(timings, "cache"):
+        cached = result_cache.get(cache_key, n)
+    if cached is not None:
+        return "ok", {"resolved_title": current.display_titles[row_pos], "recommendations": cached}
+    return "ok", (row_pos, mask, cache_key)
+
+
+def score_recommend(current, row_pos, depth, mode, nprobe, timings, mask):
+    indices, scores = current.most_similar([row_pos], depth, mode, nprobe, timings, mask)
+    with timed(timings, "build"):
+        return current.build_recommendations(indices[0], scores[0])
+
 
 @app.get("/recommend/")
-def recommend(
+async def recommend(
     title: str,
-    n: int = 10
+    n: int = 10,
+    mode: str = Query("ann", description="'ann' for the approximate index, 'exact' for a full scan"),
+    nprobe: Optional[int] = Query(None, description="Number of index lists to probe; higher is slower but more accurate"),
+    genre: Optional[str] = Query(None, description="Only recommend movies with this genre"),
+    year_min: Optional[int] = Query(None, description="Only recommend movies released in or after this year"),
+    year_max: Optional[int] = Query(None, description="Only recommend movies released in or before this year"),
+    exclude_ids: Optional[List[int]] = Query(None, description="movieIds that must not be recommended")
 ):
+    # Async only so the micro-batcher can await; every CPU-bound step runs in the threadpool,
+    # the event loop just hands work off
+    current = state
+    start, timings, status = time.perf_counter(), {}, "ok"
     try:
-        title_norm = title.lower().strip()
-        filtered = movies[movies['title'] == title_norm]
-        if filtered.empty:
-            return {"recommendations": [], "error": "Movie not found."}
-
-        row_pos = filtered.index[0]
-        movie_emb = content_embeddings[row_pos].reshape(1, -1)
-        sims = cosine_similarity(content_embeddings, movie_emb).flatten()
-        sims = np.nan_to_num(sims, nan=0.0, posinf=0.0, neginf=0.0)
-
-        sims_filtered = [(i, sims[i]) for i in range(len(movies)) if i != row_pos]
-        sims_filtered.sort(key=lambda x: x[1], reverse=True)
-
-        recommendations = []
-        for idx, score in sims_filtered[:n]:
-            rec = movies.iloc[idx]
-            genres = rec['genres']
-            if isinstance(genres, list):
-                genres_str = "|".join(genres)
-            else:
-                genres_str = ""
-            recommendations.append({
-                "title": rec['title'].title(),
-                "genres": genres_str,
-                "director": "Unknown",
-                "actors": "Unknown",
-                "similarity": round(float(score), 4)
-            })
-
-        return {"recommendations": recommendations}
+        status, result = await run_in_threadpool(
+            lookup_recommend, current, title, n, mode, nprobe, genre, year_min, year_max, exclude_ids, timings
+        )
+        if isinstance(result, dict):
+            return result
+        row_pos, mask, cache_key = result
+
+        depth = result_cache.depth_for(n)
+        if batcher is not None and mask is None and current.needs_live_scoring(depth, mode):
+            # Includes the coalescing wait; the matmul itself is shared with other requests
+            with timed(timings, "batched_score"):
+                recommendations = await batcher.submit((current, row_pos, depth))
+        else:
+            recommendations = await run_in_threadpool(score_recommend, current, row_pos, depth, mode, nprobe,
+                                                      timings, mask)
+        result_cache.set(cache_key, depth, recommendations)
+        # The title may have been matched fuzzily, so callers can see which movie the results are for
+        return {"resolved_title": current.display_titles[row_pos], "recommendations": recommendations[:max(n, 0)]}
     except Exception as e:
+        status = "error"
         print("Exception in recommend endpoint:", e)
         traceback.print_exc()
         return {"recommendations": [], "error": f"Server Exception: {str(e)}"}
+    finally:
+        record_request("recommend", status, start, timings)
+
+
+@app.post("/recommend/batch")
+def recommend_batch(request: BatchRecommendRequest):
+    current = state
+    start, timings, status = time.perf_counter(), {}, "ok"
+    try:
+        if request.mode not in ("ann", "exact"):
+            status = "bad_request"
+            return {"results": [], "error": "mode must be 'ann' or 'exact'."}
+        try:
+            mask, filter_key = resolve_filters(current, request.genre, request.year_min, request.year_max, request.exclude_ids)
+        except KeyError:
+            status = "bad_request"
+            return {"results": [], "error": f"Unknown genre '{request.genre}'."}
+        with timed(timings, "lookup"):
+            rows = [current.find_movie_row(title) for title in request.titles]
+        recommendations = {}
+        with timed(timings, "cache"):
+            for row in rows:
+                if row is not None and row not in recommendations:
+                    cached = result_cache.get((current.version, "movie", row, request.mode, request.nprobe, filter_key), request.n)
+                    if cached is not None:
+                        recommendations[row] = cached
+        missing = sorted({row for row in rows if row is not None} - set(recommendations))
+        if missing:
+            # In exact mode uncached seeds are scored a block of rows per matrix product
+            depth = result_cache.depth_for(request.n)
+            indices, scores = current.most_similar(missing, depth, request.mode, request.nprobe, timings, mask)
+            with timed(timings, "build"):
+                for row, row_indices, row_scores in zip(missing, indices, scores):
+                    recs = current.build_recommendations(row_indices, row_scores)
+                    result_cache.set((current.version, "movie", row, request.mode, request.nprobe, filter_key), depth, recs)
+                    recommendations[row] = recs[:max(request.n, 0)]
+        if None in rows:
+            metrics.inc('recommender_batch_titles_not_found_total', rows.count(None))
+
+        results = []
+        for title, row_pos in zip(request.titles, rows):
+            if row_pos is None:
+                results.append({"title": title, "recommendations": [], "error": "Movie not found."})
+                continue
+            results.append({"title": title, "resolved_title": current.display_titles[row_pos],
+                            "recommendations": recommendations[row_pos]})
+        return {"results": results}
+    except Exception as e:
+        status = "error"
+        print("Exception in recommend batch endpoint:", e)
+        traceback.print_exc()
+        return {"results": [], "error": f"Server Exception: {str(e)}"}
+    finally:
+        record_request("recommend_batch", status, start, timings)
+
+
+@app.get("/recommend/user/{user_id}")
+def recommend_for_user(
+    user_id: int,
+    n: int = 10,
+    genre: Optional[str] = None,
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    exclude_ids: Optional[List[int]] = Query(None)
+):
+    current = state
+    start, timings, status = time.perf_counter(), {}, "ok"
+    try:
+        if current.user_recommender is None:
+            status = "unavailable"
+            return {"recommendations": [], "error": "Collaborative filtering model not available."}
+        try:
+            mask, filter_key = resolve_filters(current, genre, year_min, year_max, exclude_ids)
+        except KeyError:
+            status = "bad_request"
+            return {"recommendations": [], "error": f"Unknown genre '{genre}'."}
+        cache_key = (current.version, "user", user_id, filter_key)
+        with timed(timings, "cache"):
+            cached = result_cache.get(cache_key, n)
+        if cached is not None:
+            return {"recommendations": cached}
+        depth = result_cache.depth_for(n)
+        with timed(timings, "score"):
+            result = current.user_recommender.recommend(user_id, depth, current.cf_mask(mask))
+        if result is None:
+            status = "not_found"
+            return {"recommendations": [], "error": "User not found."}
+        with timed(timings, "build"):
+            recommendations = current.build_user_recommendations(*result)
+        result_cache.set(cache_key, depth, recommendations)
+        return {"recommendations": recommendations[:max(n, 0)]}
+    except Exception as e:
+        status = "error"
+        print("Exception in user recommend endpoint:", e)
+        traceback.print_exc()
+        return {"recommendations": [], "error": f"Server Exception: {str(e)}"}
+    finally:
+        record_request("recommend_user", status, start, timings)
+
+
+@app.post("/recommend/user/batch")
+def recommend_for_users(request: BatchUserRecommendRequest):
+    current = state
+    try:
+        if current.user_recommender is None:
+            return {"results": [], "error": "Collaborative filtering model not available."}
+        try:
+            mask, _ = resolve_filters(current, request.genre, request.year_min, request.year_max, request.exclude_ids)
+        except KeyError:
+            return {"results": [], "error": f"Unknown genre '{request.genre}'."}
+        by_user = {}
+        batches = current.user_recommender.recommend_batch(request.user_ids, max(0, request.n), mask=current.cf_mask(mask))
+        for user_ids, movie_ids, scores in batches:
+            for user_id, user_movies, user_scores in zip(user_ids, movie_ids, scores):
+                by_user[user_id] = current.build_user_recommendations(user_movies, user_scores)
+        results = []
+        for user_id in request.user_ids:
+            if user_id in by_user:
+                results.append({"user_id": user_id, "recommendations": by_user[user_id]})
+            else:
+                results.append({"user_id": user_id, "recommendations": [], "error": "User not found."})
+        return {"results": results}
+    except Exception as e:
+        print("Exception in user recommend batch endpoint:", e)
+        traceback.print_exc()
+        return {"results": [], "error": f"Server Exception: {str(e)}"}
+
+
+@app.get("/stats/batching")
+def batching_stats():
+    if batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **batcher.stats()}
+
+
+@app.get("/stats/cache")
+def cache_stats():
+    return result_cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/profile")
+def profile(seconds: float = 5.0, interval_ms: float = 5.0, limit: int = 25):
+    # Samples the stacks of every other thread while live traffic is served; off unless ENABLE_PROFILER=1
+    if os.environ.get('ENABLE_PROFILER', '0') != '1':
+        return {"error": "Profiler disabled; start the API with ENABLE_PROFILER=1."}
+    return sample_stacks(min(max(seconds, 0.0), 60.0), max(interval_ms, 1.0) / 1000, max(limit, 0))
+
+
+@app.get("/admin/version")
+def model_version():
+    return {"version": state.version, "published": current_version()}
+
+
+@app.post("/admin/reload")
+def reload_models(version: Optional[str] = None):
+    try:
+        previous = state.version
+        switched = reload_state(version)
+        return {"reloaded": switched, "previous": previous, "version": state.version}
+    except ArtifactError as e:
+        return {"reloaded": False, "version": state.version, "error": str(e)}
+    except Exception as e:
+        print("Exception in reload endpoint:", e)
+        traceback.print_exc()
+        return {"reloaded": False, "version": state.version, "error": f"Server Exception: {str(e)}"}
+
+
+@app.get("/search")
+def search(q: str, limit: int = 10):
+    current = state
+    try:
+        matches = current.title_index.search(q, max(0, limit))
+        return {"results": [
+            {
+                "title": current.display_titles[row],
+                "year": int(current.title_index.years[row]) or None,
+                "score": round(score, 4)
+            }
+            for row, score in matches
+        ]}
+    except Exception as e:
+        print("Exception in search endpoint:", e)
+        traceback.print_exc()
+        return {"results": [], "error": f"Server Exception: {str(e)}"}
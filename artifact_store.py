@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+ARTIFACT_ROOT = 'models/artifacts'
+CURRENT_FILE = 'CURRENT'
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def _sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def current_version(root=ARTIFACT_ROOT):
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish_artifacts(arrays, tables, root=ARTIFACT_ROOT, keep=3):
+    # Everything is written into a hidden directory first; the version only becomes visible
+    # through a rename, and only becomes live when CURRENT is atomically replaced
+    version = time.strftime('%Y%m%dT%H%M%S') + f"-{os.getpid()}"
+    tmp_dir = os.path.join(root, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+
+    files = {}
+    for name, array in arrays.items():
+        if array is None:
+            continue
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array))
+        files[f"{name}.npy"] = None
+    for name, table in tables.items():
+        pd.to_pickle(table, os.path.join(tmp_dir, f"{name}.pkl"))
+        files[f"{name}.pkl"] = None
+    for filename in files:
+        path = os.path.join(tmp_dir, filename)
+        files[filename] = {'sha256': _sha256(path), 'bytes': os.path.getsize(path)}
+
+    manifest = {'version': version, 'created_at': time.time(), 'files': files}
+    _write_atomic(os.path.join(tmp_dir, 'manifest.json'), json.dumps(manifest, indent=2))
+    os.rename(tmp_dir, os.path.join(root, version))
+    _write_atomic(os.path.join(root, CURRENT_FILE), version)
+    prune_versions(root, keep)
+    print(f"Published artifact version {version} ({len(files)} files).")
+    return version
+
+
+def list_versions(root=ARTIFACT_ROOT):
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if not name.startswith('.') and os.path.isdir(os.path.join(root, name))
+    )
+
+
+def prune_versions(root=ARTIFACT_ROOT, keep=3):
+    # Old versions can go: processes that still map their files keep valid pages until they swap
+    current = current_version(root)
+    versions = list_versions(root)
+    for name in versions[:-keep] if keep else []:
+        if name != current:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+class ArtifactVersion:
+    def __init__(self, version=None, root=ARTIFACT_ROOT, verify_checksums=False):
+        self.version = version or current_version(root)
+        if self.version is None:
+            raise ArtifactError(f"No published artifacts under {root}")
+        # Versions can come from a request parameter; only plain names of published versions are
+        # accepted so a path like ../../dir can never point the loader outside the root
+        if os.path.basename(self.version) != self.version or self.version not in list_versions(root):
+            raise ArtifactError(f"Unknown artifact version {self.version!r}")
+        self.path = os.path.join(root, self.version)
+        with open(os.path.join(self.path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.verify(verify_checksums)
+
+    def verify(self, checksums=False):
+        # Sizes are always checked; full checksums read every byte so they are opt-in
+        for filename, meta in self.manifest['files'].items():
+            path = os.path.join(self.path, filename)
+            if not os.path.exists(path) or os.path.getsize(path) != meta['bytes']:
+                raise ArtifactError(f"{filename} is missing or truncated in version {self.version}")
+            if checksums and _sha256(path) != meta['sha256']:
+                raise ArtifactError(f"Checksum mismatch for {filename} in version {self.version}")
+
+    def has(self, name):
+        return f"{name}.npy" in self.manifest['files'] or f"{name}.pkl" in self.manifest['files']
+
+    def array(self, name, mmap_mode='r'):
+        if not self.has(name):
+            return None
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    def table(self, name):
+        return pd.read_pickle(os.path.join(self.path, f"{name}.pkl"))
@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import numpy as np
+
+import api
+from ann_index import IVFIndex
+from metrics import build_info
+from serving import ServingState
+from similarity import SimilarityEngine
+from title_index import TitleIndex
+
+
+def install_synthetic_catalog(size, random_state=0):
+    # Grow the loaded catalog to `size` rows by resampling real embeddings with a little noise,
+    # so scoring cost scales like a bigger catalog with the same embedding distribution
+    rng = np.random.default_rng(random_state)
+    base = api.state.engine.normalized
+    picks = rng.integers(0, len(base), size)
+    embeddings = base[picks] + rng.normal(scale=0.05, size=(size, base.shape[1])).astype(np.float32)
+    titles = [f"synthetic movie {i} ({1950 + i % 70})" for i in range(size)]
+    movies = api.state.movies.iloc[picks % len(api.state.movies)].reset_index(drop=True).copy()
+    movies['title'] = titles
+
+    engine = SimilarityEngine(embeddings)
+    api.state = ServingState(movies, engine, TitleIndex(titles), IVFIndex.build(engine.normalized),
+                             version=f'synthetic-{size}')
+    return titles
+
+
+async def run_load(client, titles, n, mode, concurrency, n_requests, rng):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(title):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get('/recommend/', params={'title': title, 'n': n, 'mode': mode})
+            latencies.append((time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(titles[i]) for i in rng.integers(0, len(titles), n_requests)])
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies)
+    return {
+        'requests': n_requests,
+        'throughput_rps': n_requests / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+
+async def run_benchmark(sizes, concurrencies, n_requests, n, modes):
+    rng = np.random.default_rng(0)
+    results = []
+    real_titles = api.state.movies['title'].tolist()
+    for size in sizes:
+        titles = real_titles if size is None else install_synthetic_catalog(size)
+        # The app is driven in-process through its ASGI interface, no network hop involved
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+            for mode in modes:
+                for concurrency in concurrencies:
+                    stats = await run_load(client, titles, n, mode, concurrency, n_requests, rng)
+                    stats.update({'catalog_size': len(titles), 'mode': mode, 'concurrency': concurrency, 'n': n})
+                    results.append(stats)
+                    print(f"catalog {len(titles):>7} {mode:>5} c={concurrency:<3} "
+                          f"{stats['throughput_rps']:>8.1f} req/s  p50 {stats['p50_ms']:.2f}ms  "
+                          f"p95 {stats['p95_ms']:.2f}ms  p99 {stats['p99_ms']:.2f}ms")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process throughput and latency benchmark of the recommend API")
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10000, 50000, 100000],
+                        help="Synthetic catalog sizes to run after the loaded catalog")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--n', type=int, default=10)
+    parser.add_argument('--modes', nargs='+', default=['exact', 'ann'])
+    parser.add_argument('--output', default='bench/api_benchmark.json')
+    parser.add_argument('--cache', action='store_true', help="Keep the result cache on; by default every request is scored")
+    args = parser.parse_args()
+
+    if not args.cache:
+        api.result_cache.local.max_entries = 0
+
+    results = asyncio.run(run_benchmark([None] + args.sizes, args.concurrency, args.requests, args.n, args.modes))
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'build': build_info(), 'results': results}, f, indent=2)
+    print(f"Results written to {args.output}")
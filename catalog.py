@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+def _compact_strings(values):
+    # Repeated strings (genre combinations, directors) become categoricals; mostly-unique
+    # columns such as titles stay plain strings, where a category table would only add codes
+    values = pd.Series(values).fillna('')
+    if values.nunique() < len(values) // 2:
+        return values.astype('category')
+    return values
+
+
+def compact_movies(movies):
+    # Catalog frame without per-row Python lists: genres joined once, small integer dtypes,
+    # and categoricals for low-cardinality text
+    movies = movies.reset_index(drop=True)
+    if 'genres_str' in movies.columns:
+        genres_str = movies['genres_str']
+    else:
+        # Lists from the enriched pickle, or movies.csv-style pipe strings
+        genres_str = movies['genres'].apply(lambda gs: "|".join(gs) if isinstance(gs, list) else gs)
+    if 'year' in movies.columns:
+        years = pd.to_numeric(movies['year'], errors='coerce')
+    else:
+        years = pd.to_numeric(movies['title'].str.extract(r'\((\d{4})\)\s*$')[0], errors='coerce')
+    compact = pd.DataFrame({
+        'movieId': movies['movieId'].to_numpy(np.int32),
+        'title': movies['title'].to_numpy(),
+        # 0 marks an unknown year
+        'year': years.fillna(0).to_numpy(np.int16),
+        'genres_str': pd.Categorical(genres_str.fillna('').astype(str)),
+    })
+    for column in ('director_name', 'actor_names'):
+        if column in movies.columns:
+            compact[column] = _compact_strings(movies[column].to_numpy())
+    return compact
+
+
+# Array view of a compact catalog: a movieId -> row index and each movie's genre ids as one
+# CSR-style (offsets, ids) pair, so per-genre work never touches Python lists
+class Catalog:
+    def __init__(self, movies):
+        self.movie_ids = movies['movieId'].to_numpy(np.int32)
+        self._id_order = np.argsort(self.movie_ids, kind='stable').astype(np.int32)
+        self._sorted_ids = self.movie_ids[self._id_order]
+        self.years = movies['year'].to_numpy(np.int16) if 'year' in movies.columns else np.zeros(len(movies), np.int16)
+        self.genres_strs = movies['genres_str'].to_numpy(dtype=object)
+        self._build_genres(movies['genres_str'].astype('category'))
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def _build_genres(self, genres):
+        # Split each distinct genre combination once, then expand by category code
+        combos = [[g for g in str(c).split('|') if g] for c in genres.cat.categories]
+        self.genre_names = sorted({g for gs in combos for g in gs})
+        genre_id = {g: i for i, g in enumerate(self.genre_names)}
+        id_dtype = np.uint8 if len(self.genre_names) <= 256 else np.int32
+        combo_ids = [np.array([genre_id[g] for g in gs], dtype=id_dtype) for gs in combos]
+        combo_lengths = np.array([len(ids) for ids in combo_ids] + [0], dtype=np.int64)
+        combo_starts = np.concatenate([[0], np.cumsum(combo_lengths[:-1])])
+        flat = np.concatenate(combo_ids) if combo_ids else np.empty(0, dtype=id_dtype)
+
+        codes = genres.cat.codes.to_numpy()
+        # Missing values (code -1) index the trailing zero-length slot
+        lengths = combo_lengths[codes]
+        self.genre_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        entry_row = np.repeat(np.arange(len(codes)), lengths)
+        within = np.arange(int(self.genre_offsets[-1])) - self.genre_offsets[:-1][entry_row]
+        self.genre_ids = flat[combo_starts[codes][entry_row] + within].astype(id_dtype)
+        self._genre_rows = entry_row.astype(np.int32)
+
+    def rows_for(self, movie_ids):
+        # Catalog rows for movieIds, -1 where the catalog does not have the movie
+        movie_ids = np.asarray(movie_ids)
+        if not len(self._sorted_ids):
+            return np.full(len(movie_ids), -1, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self._sorted_ids, movie_ids), 0, len(self._sorted_ids) - 1)
+        return np.where(self._sorted_ids[pos] == movie_ids, self._id_order[pos], -1)
+
+    def row_for(self, movie_id):
+        row = int(self.rows_for([movie_id])[0])
+        return None if row < 0 else row
+
+    def genres_of(self, row):
+        return [self.genre_names[i] for i in self.genre_ids[self.genre_offsets[row]:self.genre_offsets[row + 1]]]
+
+    def genre_mask(self, genre):
+        mask = np.zeros(len(self), dtype=bool)
+        if genre in self.genre_names:
+            mask[self._genre_rows[self.genre_ids == self.genre_names.index(genre)]] = True
+        return mask
@@ -0,0 +1,123 @@
+import os
+
+import joblib
+import numpy as np
+from joblib import Parallel, delayed
+from scipy import sparse
+
+
+def factorize(values):
+    uniques, inverse = np.unique(values, return_inverse=True)
+    return inverse.astype(np.int32), uniques
+
+
+def build_rating_matrix(ratings):
+    # Dense ids -> contiguous indices; the matrix itself stays CSR throughout
+    user_idx, user_ids = factorize(ratings['userId'].to_numpy())
+    movie_idx, movie_ids = factorize(ratings['movieId'].to_numpy())
+    matrix = sparse.csr_matrix(
+        (ratings['rating'].to_numpy(dtype=np.float32), (user_idx, movie_idx)),
+        shape=(len(user_ids), len(movie_ids)),
+        dtype=np.float32,
+    )
+    matrix.sum_duplicates()
+    return matrix, user_ids, movie_ids
+
+
+def _solve_block(matrix, fixed, reg, start, stop, max_entries=1 << 12):
+    # Normal equations for many rows at once: rows are sorted by rating count and padded to the
+    # longest row of each batch, so one batched matmul and one stacked (B, f, f) solve replace a
+    # Python-level solve per row. max_entries bounds the padded (B, L, f) gather per batch; at
+    # 64 factors the default keeps it around 2 MB, which measured faster than larger batches.
+    # fixed is float64 with one extra all-zero row that padding positions point at.
+    n_factors = fixed.shape[1]
+    out = np.zeros((stop - start, n_factors), dtype=np.float32)
+    eye = np.eye(n_factors, dtype=np.float64)
+    indptr = matrix.indptr[start:stop + 1]
+    counts = np.diff(indptr)
+    order = np.flatnonzero(counts)
+    order = order[np.argsort(counts[order], kind='stable')]
+    i = 0
+    while i < len(order):
+        # Padded size of taking rows i..j-1 grows with j, so the cut point is a binary search
+        sizes = np.arange(1, len(order) - i + 1) * counts[order[i:]]
+        j = i + max(1, int(np.searchsorted(sizes, max_entries, side='right')))
+        batch = order[i:j]
+        lengths = counts[batch]
+        offsets = np.arange(lengths[-1])
+        valid = offsets < lengths[:, None]
+        positions = np.where(valid, indptr[batch][:, None] + offsets, indptr[batch][:, None])
+        factors = fixed[np.where(valid, matrix.indices[positions], len(fixed) - 1)]
+        values = np.where(valid, matrix.data[positions], 0).astype(np.float64)
+        factors_t = factors.transpose(0, 2, 1)
+        # Weighted-lambda regularization scales with the number of observed ratings
+        a = factors_t @ factors + reg * lengths[:, None, None] * eye
+        b = factors_t @ values[..., None]
+        out[batch] = np.linalg.solve(a, b)[..., 0]
+        i = j
+    return start, out
+
+
+def solve_factors(matrix, fixed, reg=0.1, n_jobs=-1, block_size=2048):
+    # Each block is a few batched BLAS/LAPACK calls that release the GIL, so threads share the
+    # CSR matrix without copies
+    fixed = np.vstack([fixed, np.zeros((1, fixed.shape[1]))]).astype(np.float64)
+    blocks = [(start, min(start + block_size, matrix.shape[0])) for start in range(0, matrix.shape[0], block_size)]
+    results = Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(_solve_block)(matrix, fixed, reg, start, stop) for start, stop in blocks
+    )
+    factors = np.zeros((matrix.shape[0], fixed.shape[1]), dtype=np.float32)
+    for start, out in results:
+        factors[start:start + len(out)] = out
+    return factors
+
+
+def als_fit(matrix, n_factors=64, reg=0.1, n_iter=10, n_jobs=-1, random_state=42, verbose=True):
+    rng = np.random.default_rng(random_state)
+    matrix = matrix.tocsr()
+    matrix_t = matrix.T.tocsr()
+    item_factors = rng.normal(scale=0.1, size=(matrix.shape[1], n_factors)).astype(np.float32)
+    user_factors = None
+    for iteration in range(n_iter):
+        user_factors = solve_factors(matrix, item_factors, reg, n_jobs)
+        item_factors = solve_factors(matrix_t, user_factors, reg, n_jobs)
+        if verbose:
+            print(f"ALS iteration {iteration + 1}/{n_iter}: train RMSE {train_rmse(matrix, user_factors, item_factors):.4f}")
+    return user_factors, item_factors
+
+
+def train_rmse(matrix, user_factors, item_factors, block_size=1_000_000):
+    coo = matrix.tocoo()
+    squared_error = 0.0
+    for start in range(0, coo.nnz, block_size):
+        rows = coo.row[start:start + block_size]
+        cols = coo.col[start:start + block_size]
+        pred = np.einsum('ij,ij->i', user_factors[rows], item_factors[cols])
+        squared_error += float(np.sum((coo.data[start:start + block_size] - pred) ** 2))
+    return np.sqrt(squared_error / max(1, coo.nnz))
+
+
+def save_cf_artifacts(user_factors, item_factors, user_ids, movie_ids, matrix=None, model_dir='models'):
+    os.makedirs(model_dir, exist_ok=True)
+    # Index -> raw id, the layout evaluation.py inverts
+    joblib.dump(user_factors, os.path.join(model_dir, 'user_factors.pkl'))
+    joblib.dump(item_factors, os.path.join(model_dir, 'item_factors.pkl'))
+    joblib.dump(dict(enumerate(user_ids.tolist())), os.path.join(model_dir, 'user_id_map.pkl'))
+    joblib.dump(dict(enumerate(movie_ids.tolist())), os.path.join(model_dir, 'movie_id_map.pkl'))
+    if matrix is not None:
+        # CSR structure of the training ratings, used to mask already-seen movies when serving.
+        # Written next to the old file and swapped in, so a process mapping the old one keeps it.
+        seen = {'seen_indptr': matrix.indptr.astype(np.int64), 'seen_indices': matrix.indices.astype(np.int32)}
+        for name, array in seen.items():
+            np.save(os.path.join(model_dir, f'{name}.tmp.npy'), array)
+            os.replace(os.path.join(model_dir, f'{name}.tmp.npy'), os.path.join(model_dir, f'{name}.npy'))
+
+
+def load_cf_artifacts(model_dir='models'):
+    user_factors = np.asarray(joblib.load(os.path.join(model_dir, 'user_factors.pkl')), dtype=np.float32)
+    item_factors = np.asarray(joblib.load(os.path.join(model_dir, 'item_factors.pkl')), dtype=np.float32)
+    user_id_map = joblib.load(os.path.join(model_dir, 'user_id_map.pkl'))
+    movie_id_map = joblib.load(os.path.join(model_dir, 'movie_id_map.pkl'))
+    user_ids = np.array([user_id_map[i] for i in range(len(user_id_map))], dtype=np.int64)
+    movie_ids = np.array([movie_id_map[i] for i in range(len(movie_id_map))], dtype=np.int64)
+    return user_factors, item_factors, user_ids, movie_ids
@@ -0,0 +1,125 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.preprocessing import MultiLabelBinarizer, normalize
+
+GENOME_PATH = 'data/genome-scores.csv'
+DEFAULT_WEIGHTS = {'genres': 1.0, 'people': 0.6, 'genome': 1.0}
+
+
+def people_tokens(director_name, actor_names):
+    # Namespaced so a director and an actor with the same name stay separate features
+    tokens = []
+    if isinstance(director_name, str) and director_name != 'Unknown':
+        tokens += [f"director={name.strip().lower()}" for name in director_name.split(',') if name.strip()]
+    if isinstance(actor_names, str) and actor_names != 'Unknown':
+        tokens += [f"actor={name.strip().lower()}" for name in actor_names.split(',') if name.strip()]
+    return tokens
+
+
+def read_genome_matrix(movie_ids, path=GENOME_PATH, n_tags=None, min_relevance=0.0, chunksize=1_000_000):
+    # Genome scores streamed into CSR: one row per catalog movie, one column per tagId.
+    # Only the kept (row, col, value) triplets are held, in compact dtypes, until the final build.
+    movie_ids = np.asarray(movie_ids)
+    order = np.argsort(movie_ids)
+    sorted_ids = movie_ids[order]
+    rows, cols, values = [], [], []
+    max_tag = 0
+    dtypes = {'movieId': np.int32, 'tagId': np.int32, 'relevance': np.float32}
+    for chunk in pd.read_csv(path, dtype=dtypes, chunksize=chunksize):
+        pos = np.clip(np.searchsorted(sorted_ids, chunk['movieId'].to_numpy()), 0, max(len(sorted_ids) - 1, 0))
+        keep = (sorted_ids[pos] == chunk['movieId'].to_numpy()) & (chunk['relevance'].to_numpy() > min_relevance)
+        rows.append(order[pos[keep]].astype(np.int32))
+        cols.append((chunk['tagId'].to_numpy()[keep] - 1).astype(np.int32))
+        values.append(chunk['relevance'].to_numpy()[keep])
+        if len(chunk):
+            max_tag = max(max_tag, int(chunk['tagId'].max()))
+    if n_tags is None:
+        n_tags = max_tag
+    rows, cols, values = (np.concatenate(a) if a else np.empty(0) for a in (rows, cols, values))
+    # Tags beyond the fitted width (added upstream since the full build) are ignored
+    known = cols < n_tags
+    return sparse.csr_matrix(
+        (values[known].astype(np.float32), (rows[known], cols[known])),
+        shape=(len(movie_ids), n_tags),
+        dtype=np.float32,
+    )
+
+
+# Sparse content features -> dense embeddings. Each block (genres, director/actor tokens,
+# genome tags) is L2-normalized per movie and scaled by its weight before the blocks are
+# stacked, so no single block dominates the SVD just by having more columns.
+class ContentFeaturePipeline:
+    def __init__(self, n_components=64, weights=None, people_features=2 ** 16, genome_path=GENOME_PATH,
+                 genome_min_relevance=0.0, random_state=42):
+        unknown = sorted(set(weights or {}) - set(DEFAULT_WEIGHTS))
+        if unknown:
+            raise ValueError(f"Unknown feature block(s) {', '.join(unknown)}; expected one of "
+                             f"{', '.join(DEFAULT_WEIGHTS)}")
+        self.n_components = n_components
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.people_features = people_features
+        self.genome_path = genome_path
+        self.genome_min_relevance = genome_min_relevance
+        self.random_state = random_state
+
+    def _genre_lists(self, movies):
+        return movies['genres'].apply(lambda gs: gs if isinstance(gs, list) else [])
+
+    def _people_counts(self, movies):
+        hasher = FeatureHasher(n_features=self.people_features, input_type='string', alternate_sign=False)
+        tokens = [people_tokens(d, a) for d, a in zip(movies['director_name'], movies['actor_names'])]
+        return hasher.transform(tokens).astype(np.float32)
+
+    def _stack(self, blocks):
+        weighted = [normalize(block.tocsr()) * self.weights[name] for name, block in blocks if self.weights.get(name)]
+        if not weighted:
+            raise ValueError(f"Every available feature block ({', '.join(name for name, _ in blocks)}) "
+                             f"has weight 0; at least one needs a positive weight")
+        return sparse.hstack(weighted, format='csr', dtype=np.float32)
+
+    def fit_transform(self, movies):
+        self.genre_binarizer = MultiLabelBinarizer(sparse_output=True)
+        blocks = [('genres', self.genre_binarizer.fit_transform(self._genre_lists(movies)))]
+        if 'director_name' in movies.columns:
+            self.people_tfidf = TfidfTransformer(sublinear_tf=True)
+            blocks.append(('people', self.people_tfidf.fit_transform(self._people_counts(movies))))
+        else:
+            self.people_tfidf = None
+        self.n_tags = None
+        if self.genome_path and os.path.exists(self.genome_path):
+            genome = read_genome_matrix(movies['movieId'], self.genome_path, min_relevance=self.genome_min_relevance)
+            self.n_tags = genome.shape[1]
+            blocks.append(('genome', genome))
+        features = self._stack(blocks)
+
+        # Randomized SVD works on the sparse matrix directly; the dense input never exists
+        n_components = max(1, min(self.n_components, features.shape[1] - 1, features.shape[0] - 1))
+        self.svd = TruncatedSVD(n_components=n_components, algorithm='randomized', n_iter=7,
+                                random_state=self.random_state)
+        embeddings = self.svd.fit_transform(features)
+        print(f"Content features: {features.shape[0]} movies x {features.shape[1]} columns "
+              f"({features.nnz} non-zeros) -> {n_components} dims, "
+              f"explained variance {self.svd.explained_variance_ratio_.sum():.1%}")
+        return embeddings.astype(np.float32)
+
+    def transform(self, movies):
+        # Projects movies the pipeline was not fitted on; unseen genres and tags are dropped
+        known = set(self.genre_binarizer.classes_)
+        genres = self._genre_lists(movies).apply(lambda gs: [g for g in gs if g in known])
+        blocks = [('genres', self.genre_binarizer.transform(genres))]
+        if self.people_tfidf is not None:
+            blocks.append(('people', self.people_tfidf.transform(self._people_counts(movies))))
+        if self.n_tags is not None:
+            genome_path = self.genome_path if os.path.exists(self.genome_path) else None
+            if genome_path:
+                genome = read_genome_matrix(movies['movieId'], genome_path, self.n_tags, self.genome_min_relevance)
+            else:
+                genome = sparse.csr_matrix((len(movies), self.n_tags), dtype=np.float32)
+            blocks.append(('genome', genome))
+        return self.svd.transform(self._stack(blocks)).astype(np.float32)
@@ -1,5 +1,9 @@
 import pandas as pd
 import re
+import argparse
+
+from metrics import stage_timer
+from ratings_store import CSV_DTYPES, compact_ratings, ingest_ratings_chunked
 
 def normalize_title(title):
     if pd.isna(title):
@@ -8,9 +12,9 @@ def normalize_title(title):
     s = re.sub(r'[^\w\s]', '', s)  # remove all punctuation
     return s
 
-def load_and_process_movielens():
-    movies = pd.read_csv('data/movies.csv')
-    ratings = pd.read_csv('data/ratings.csv')
+def load_and_process_movielens(streaming=False):
+    with stage_timer('ingestion', 'read_movies'):
+        movies = pd.read_csv('data/movies.csv')
 
     # Normalize titles and extract years with better cleaning
     movies['title_original'] = movies['title']
@@ -20,16 +24,17 @@ def load_and_process_movielens():
     # Normalize titles by removing punctuation
     movies['title_norm'] = movies['title'].apply(normalize_title)
 
-    imdb_metadata = pd.read_pickle('data/imdb_metadata.pkl')
-    imdb_metadata['primaryTitle_norm'] = imdb_metadata['primaryTitle'].apply(normalize_title)
+    with stage_timer('ingestion', 'imdb_join'):
+        imdb_metadata = pd.read_pickle('data/imdb_metadata.pkl')
+        imdb_metadata['primaryTitle_norm'] = imdb_metadata['primaryTitle'].apply(normalize_title)
 
-    # Join on normalized title and year
-    movies = movies.merge(
-        imdb_metadata,
-        left_on=['title_norm', 'year'],
-        right_on=['primaryTitle_norm', 'startYear'],
-        how='left'
-    )
+        # Join on normalized title and year
+        movies = movies.merge(
+            imdb_metadata,
+            left_on=['title_norm', 'year'],
+            right_on=['primaryTitle_norm', 'startYear'],
+            how='left'
+        )
 
     movies['genres'] = movies['genres'].fillna('').apply(lambda x: x.split('|') if x else [])
 
@@ -39,12 +44,22 @@ def load_and_process_movielens():
 
     # Reset index before saving
     movies.reset_index(drop=True, inplace=True)
-    movies.to_pickle('data/enriched_movies.pkl')
-    ratings.to_pickle('data/processed_ratings.pkl')
+    with stage_timer('ingestion', 'write_movies', rows=len(movies)):
+        movies.to_pickle('data/enriched_movies.pkl')
+    with stage_timer('ingestion', 'ratings', streaming=streaming):
+        if streaming:
+            ingest_ratings_chunked()
+        else:
+            ratings = compact_ratings(pd.read_csv('data/ratings.csv', dtype=CSV_DTYPES))
+            ratings.to_pickle('data/processed_ratings.pkl')
 
     print("Data ingestion complete, enriched movies saved.")
     print(f"Movies with director known: {(movies['director_name'] != 'Unknown').sum()} of {len(movies)}")
     print(f"Movies with actors known: {(movies['actor_names'] != 'Unknown').sum()} of {len(movies)}")
 
 if __name__ == "__main__":
-    load_and_process_movielens()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streaming', action='store_true',
+                        help="Read ratings in chunks into the typed columnar store instead of one pickle")
+    args = parser.parse_args()
+    load_and_process_movielens(streaming=args.streaming)
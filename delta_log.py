@@ -0,0 +1,41 @@
+import os
+import shutil
+import time
+
+import pandas as pd
+
+# Append-only log of the deltas incremental_update.py applies. Full ingestion reads the base CSVs
+# plus every logged delta, so a rebuild keeps what was applied incrementally instead of dropping it.
+RATINGS_DELTA_LOG = 'data/deltas/ratings'
+MOVIES_DELTA_LOG = 'data/deltas/movies'
+
+
+def logged_deltas(log_dir):
+    # Oldest first: names start with a zero-padded sequence number
+    if not os.path.isdir(log_dir):
+        return []
+    return [os.path.join(log_dir, name) for name in sorted(os.listdir(log_dir)) if name.endswith('.csv')]
+
+
+def append_delta(path, log_dir):
+    # Copied under a hidden name and renamed, so a reader never sees a half-written delta
+    os.makedirs(log_dir, exist_ok=True)
+    name = f"{len(logged_deltas(log_dir)):06d}-{time.strftime('%Y%m%dT%H%M%S')}.csv"
+    tmp_path = os.path.join(log_dir, f".{name}.tmp")
+    shutil.copyfile(path, tmp_path)
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(log_dir, name))
+    print(f"Logged {path} as {os.path.join(log_dir, name)}.")
+    return os.path.join(log_dir, name)
+
+
+def read_movies(path='data/movies.csv'):
+    # movies.csv plus logged movie deltas; a movieId already present keeps its first row, as
+    # add_new_movies does when the delta is applied
+    deltas = logged_deltas(MOVIES_DELTA_LOG)
+    movies = pd.read_csv(path)
+    if not deltas:
+        return movies
+    movies = pd.concat([movies] + [pd.read_csv(delta) for delta in deltas], ignore_index=True)
+    return movies.drop_duplicates('movieId').reset_index(drop=True)
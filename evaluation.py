@@ -1,10 +1,11 @@
-import pandas as pd
 import joblib
 from sklearn.metrics import mean_squared_error
 import numpy as np
 
+from ratings_store import load_ratings
+
 def evaluate():
-    ratings = pd.read_pickle("data/processed_ratings.pkl")
+    ratings = load_ratings(["userId", "movieId", "rating"])
     user_factors = joblib.load("models/user_factors.pkl")
     item_factors = joblib.load("models/item_factors.pkl")
     user_id_map = joblib.load("models/user_id_map.pkl")
@@ -23,6 +24,7 @@ def evaluate():
     pred_ratings = np.sum(user_factors[ratings_eval['user_idx']] * item_factors[ratings_eval['movie_idx']], axis=1)
     rmse = np.sqrt(mean_squared_error(ratings_eval['rating'], pred_ratings))
     print(f"Evaluation RMSE: {rmse:.4f}")
+    return float(rmse)
 
 if __name__ == "__main__":
     evaluate()
@@ -1,58 +1,122 @@
 import pandas as pd
-import re
+import argparse
 import numpy as np
 
-def normalize_title(title):
-    if pd.isna(title):
-        return ""
-    s = title.lower().strip()
-    s = re.sub(r'[^\w\s]', '', s)  # remove all punctuation
-    return s
-
-def load_and_process_movielens():
-    movies = pd.read_csv('data/movies.csv')
-
-    # Extract year as numeric and normalize titles
-    movies['title_original'] = movies['title']
-    movies['title'] = movies['title'].str.lower().str.strip()
-    movies['year'] = pd.to_numeric(movies['title'].str.extract(r'\((\d{4})\)')[0], errors='coerce')
-    movies['title_norm'] = movies['title'].apply(normalize_title)
-
-    imdb_metadata = pd.read_pickle('data/imdb_metadata.pkl')
-    imdb_metadata['primaryTitle_norm'] = imdb_metadata['primaryTitle'].apply(normalize_title)
-    imdb_metadata['startYear'] = pd.to_numeric(imdb_metadata['startYear'], errors='coerce')
-
-    # Do a loose merge on normalized titles
-    merged = pd.merge(
-        movies,
-        imdb_metadata,
-        left_on='title_norm',
-        right_on='primaryTitle_norm',
-        how='left',
-        suffixes=('', '_imdb')
-    )
-
-    # Calculate year difference and keep matches where difference is <= 1 or startYear missing
-    merged['year_diff'] = (merged['year'] - merged['startYear']).abs()
-    merged_filtered = merged[(merged['year_diff'] <= 1) | (merged['startYear'].isna())]
+from delta_log import read_movies
+from metrics import stage_timer
+from ratings_store import ingest_ratings_chunked, read_ratings_frame
+
+def normalize_title_series(titles):
+    # Vectorized equivalent of data_ingestion.normalize_title
+    return titles.fillna('').astype(str).str.lower().str.strip().str.replace(r'[^\w\s]', '', regex=True)
+
+def iter_imdb_chunks(path, chunksize=500_000):
+    # Only CSV/TSV sources are read chunk by chunk; a pickle has to be loaded whole and is then
+    # only joined in slices, so peak memory still includes the full frame
+    if path.endswith('.pkl'):
+        imdb_metadata = pd.read_pickle(path)
+        for start in range(0, len(imdb_metadata), chunksize):
+            yield imdb_metadata.iloc[start:start + chunksize]
+    else:
+        sep = '\t' if path.endswith('.tsv') or path.endswith('.tsv.gz') else ','
+        yield from pd.read_csv(path, sep=sep, chunksize=chunksize, na_values='\\N',
+                               usecols=['primaryTitle', 'startYear', 'director_name', 'actor_names'])
+
+def join_imdb_metadata(movies, imdb_path='data/imdb_metadata.pkl', chunksize=500_000):
+    # Each movie is blocked under (title, year - 1), (title, year) and (title, year + 1),
+    # so the merge only ever materializes candidates within one year
+    offsets = np.array([-1, 0, 1])
+    dated = movies[movies['year'].notna()]
+    blocks = pd.DataFrame({
+        'movie_row': np.repeat(dated.index.to_numpy(), len(offsets)),
+        'title_norm': np.repeat(dated['title_norm'].to_numpy(), len(offsets)),
+        'block_year': (np.repeat(dated['year'].to_numpy(), len(offsets)) + np.tile(offsets, len(dated))).astype(np.int32),
+    })
+    titles = movies[['title_norm']].reset_index(names='movie_row')
+    known_titles = set(movies['title_norm'])
+
+    matches = []
+    for chunk in iter_imdb_chunks(imdb_path, chunksize):
+        chunk = chunk[['primaryTitle', 'startYear', 'director_name', 'actor_names']].copy()
+        chunk['title_norm'] = normalize_title_series(chunk['primaryTitle'])
+        chunk = chunk[chunk['title_norm'].isin(known_titles)]
+        chunk['startYear'] = pd.to_numeric(chunk['startYear'], errors='coerce')
+
+        with_year = chunk[chunk['startYear'].notna()].astype({'startYear': np.int32})
+        matched = blocks.merge(with_year, left_on=['title_norm', 'block_year'], right_on=['title_norm', 'startYear'])
+        matches.append(matched[['movie_row', 'startYear', 'director_name', 'actor_names']])
+
+        # IMDb rows without a year can only be matched on title
+        without_year = chunk[chunk['startYear'].isna()]
+        if len(without_year):
+            matched = titles.merge(without_year, on='title_norm')
+            matches.append(matched[['movie_row', 'startYear', 'director_name', 'actor_names']])
+
+    columns = ['movie_row', 'startYear', 'director_name', 'actor_names']
+    matches = pd.concat(matches, ignore_index=True) if matches else pd.DataFrame(columns=columns)
+    # movie_row holds index labels, so years are looked up by label as well
+    matches['year_diff'] = (movies.loc[matches['movie_row'], 'year'].to_numpy() - matches['startYear']).abs()
+    # Keep the closest-year candidate per movie so the catalog keeps one row per movieId
+    matches = matches.sort_values(['movie_row', 'year_diff'], na_position='last').drop_duplicates('movie_row')
+    merged = movies.join(matches.set_index('movie_row')[['startYear', 'director_name', 'actor_names']])
+    merged['imdb_match'] = merged.index.isin(matches['movie_row'])
+    return merged
+
+def enrich_movies(movies, imdb_path='data/imdb_metadata.pkl'):
+    # movies.csv rows -> the enriched catalog layout; also used to add new movies incrementally,
+    # where the filtered delta no longer has a 0..n-1 index
+    movies = movies.reset_index(drop=True)
+
+    # Extract year as numeric and normalize titles without the "(year)" suffix
+    with stage_timer('ingestion', 'normalize_titles', rows=len(movies)):
+        movies['year'] = pd.to_numeric(movies['title'].str.extract(r'\((\d{4})\)\s*$')[0], errors='coerce')
+        movies['title_norm'] = normalize_title_series(movies['title'].str.replace(r'\s*\(\d{4}\)\s*$', '', regex=True))
+
+    with stage_timer('ingestion', 'imdb_join'):
+        merged = join_imdb_metadata(movies, imdb_path)
 
     # Fill missing director/actor names with 'Unknown'
-    merged_filtered['director_name'] = merged_filtered['director_name'].fillna('Unknown').replace('', 'Unknown')
-    merged_filtered['actor_names'] = merged_filtered['actor_names'].fillna('Unknown').replace('', 'Unknown')
+    merged['director_name'] = merged['director_name'].fillna('Unknown').replace('', 'Unknown')
+    merged['actor_names'] = merged['actor_names'].fillna('Unknown').replace('', 'Unknown')
+    merged['genres'] = merged['genres'].fillna('').apply(lambda x: x.split('|') if x else [])
 
     # Keep relevant columns only and reset index
-    final_movies = merged_filtered[['title_original', 'title', 'year', 'genres', 'director_name', 'actor_names']].copy()
-    final_movies.rename(columns={'title_original': 'title'}, inplace=True)
+    final_movies = merged[['movieId', 'title', 'year', 'genres', 'director_name', 'actor_names']].copy()
     final_movies.reset_index(drop=True, inplace=True)
+    return final_movies, int(merged['imdb_match'].sum())
 
-    final_movies.to_pickle('data/enriched_movies.pkl')
+def ingest_movies():
+    with stage_timer('ingestion', 'read_movies'):
+        movies = read_movies()
 
-    ratings = pd.read_csv('data/ratings.csv')
-    ratings.to_pickle('data/processed_ratings.pkl')
+    final_movies, matched = enrich_movies(movies)
 
-    print("Data ingestion complete, enriched movies saved.")
+    with stage_timer('ingestion', 'write_movies', rows=len(final_movies)):
+        final_movies.to_pickle('data/enriched_movies.pkl')
+
+    print("Enriched movies saved.")
+    print(f"IMDb match rate: {matched} of {len(final_movies)} ({matched / max(1, len(final_movies)):.1%})")
     print(f"Movies with director known: {(final_movies['director_name'] != 'Unknown').sum()} of {len(final_movies)}")
     print(f"Movies with actors known: {(final_movies['actor_names'] != 'Unknown').sum()} of {len(final_movies)}")
 
+def ingest_ratings(streaming=False):
+    with stage_timer('ingestion', 'ratings', streaming=streaming):
+        if streaming:
+            ingest_ratings_chunked()
+        else:
+            ratings = read_ratings_frame()
+            ratings.to_pickle('data/processed_ratings.pkl')
+    print("Ratings saved.")
+
+def load_and_process_movielens(streaming=False):
+    # Movies and ratings are independent; the pipeline runner schedules them as separate stages
+    ingest_movies()
+    ingest_ratings(streaming)
+    print("Data ingestion complete.")
+
 if __name__ == "__main__":
-    load_and_process_movielens()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streaming', action='store_true',
+                        help="Read ratings in chunks into the typed columnar store instead of one pickle")
+    args = parser.parse_args()
+    load_and_process_movielens(streaming=args.streaming)
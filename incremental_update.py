@@ -0,0 +1,161 @@
+import argparse
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from analytics_aggregates import ANALYTICS_DIR, update_analytics_aggregates
+from ann_index import IVFIndex
+from cf_model import load_cf_artifacts, save_cf_artifacts, solve_factors
+from imdb_metadata_ingestion import enrich_movies
+from metrics import stage_timer
+from model_building import extend_neighbour_table, project_content_embeddings
+from delta_log import MOVIES_DELTA_LOG, RATINGS_DELTA_LOG, append_delta
+from ratings_store import RatingsStore, apply_ratings_delta, compact_ratings_store, read_ratings_csv
+from serving import publish_model_files
+from similarity import l2_normalize
+
+# Incremental refresh between full rebuilds: apply a ratings delta (and optionally new movies)
+# to the ratings store, the analytics aggregates, the CF factors and the content artifacts,
+# then publish a new artifact version. Each delta is first appended to the delta log that full
+# ingestion reads, so the full pipeline stays the way to resync everything without losing them.
+
+
+def add_new_movies(new_movies):
+    movies = pd.read_pickle('data/enriched_movies.pkl')
+    new_movies = new_movies[~new_movies['movieId'].isin(movies['movieId'])].drop_duplicates('movieId').reset_index(drop=True)
+    content_embeddings = joblib.load('models/content_embeddings.pkl')
+    ann_index = IVFIndex.load('models/ann_index.npz') if os.path.exists('models/ann_index.npz') else None
+    if os.path.exists('models/neighbour_ids.npy'):
+        neighbour_ids = np.load('models/neighbour_ids.npy', mmap_mode='r')
+        neighbour_scores = np.load('models/neighbour_scores.npy', mmap_mode='r')
+    else:
+        neighbour_ids = neighbour_scores = None
+    if not len(new_movies):
+        return movies, content_embeddings, ann_index, neighbour_ids, neighbour_scores
+
+    # New rows go at the end so existing row positions (and neighbour ids) stay valid
+    with stage_timer('incremental', 'enrich_movies', movies=len(new_movies)):
+        enriched, _ = enrich_movies(new_movies)
+        movies = pd.concat([movies, enriched], ignore_index=True)
+    n_existing = len(content_embeddings)
+    with stage_timer('incremental', 'project_embeddings', movies=len(enriched)):
+        new_embeddings = project_content_embeddings(enriched)
+        content_embeddings = np.vstack([content_embeddings, new_embeddings])
+    if ann_index is not None:
+        with stage_timer('incremental', 'ann_add'):
+            ann_index = ann_index.add(l2_normalize(new_embeddings), np.arange(n_existing, len(content_embeddings)))
+    if neighbour_ids is not None:
+        with stage_timer('incremental', 'neighbour_table'):
+            neighbour_ids, neighbour_scores = extend_neighbour_table(content_embeddings, n_existing)
+
+    movies.to_pickle('data/enriched_movies.pkl')
+    joblib.dump(content_embeddings, 'models/content_embeddings.pkl')
+    if ann_index is not None:
+        ann_index.save('models/ann_index.npz')
+    print(f"Added {len(enriched)} new movies to the catalog.")
+    return movies, content_embeddings, ann_index, neighbour_ids, neighbour_scores
+
+
+def _ratings_matrix(store, ids, by, column_index):
+    # Rows = ids, columns = positions in column_index; ratings for unknown columns are skipped
+    owner, columns = store.ratings_for('userId' if by == 'user' else 'movieId', ids)
+    cols = column_index.get_indexer(columns['movieId' if by == 'user' else 'userId'])
+    known = cols >= 0
+    return sparse.csr_matrix(
+        (columns['rating_x2'][known].astype(np.float32) / 2, (owner[known], cols[known])),
+        shape=(len(ids), len(column_index)),
+        dtype=np.float32,
+    )
+
+
+def fold_in_ratings(changed_users, reg=0.1, n_jobs=-1, model_dir='models'):
+    # Least-squares solves against fixed factors, the half-step ALS alternates on:
+    # changed users against item factors, then movies the model has never seen against the
+    # refreshed users, then the changed users once more so they pick up those new movies
+    user_factors, item_factors, user_ids, movie_ids = load_cf_artifacts(model_dir)
+    store = RatingsStore()
+
+    new_users = np.setdiff1d(changed_users, user_ids)
+    user_ids = np.concatenate([user_ids, new_users])
+    user_factors = np.vstack([user_factors, np.zeros((len(new_users), user_factors.shape[1]), dtype=np.float32)])
+    user_index = pd.Index(user_ids)
+    changed_positions = user_index.get_indexer(changed_users)
+
+    movie_index = pd.Index(movie_ids)
+    matrix = _ratings_matrix(store, changed_users, 'user', movie_index)
+    user_factors[changed_positions] = solve_factors(matrix, item_factors, reg, n_jobs)
+
+    rated_movies = np.unique(store.ratings_for('userId', changed_users)[1]['movieId'])
+    new_movies = np.setdiff1d(rated_movies, movie_ids)
+    if len(new_movies):
+        item_matrix = _ratings_matrix(store, new_movies, 'movie', user_index)
+        item_factors = np.vstack([item_factors, solve_factors(item_matrix, user_factors, reg, n_jobs)])
+        movie_ids = np.concatenate([movie_ids, new_movies])
+        movie_index = pd.Index(movie_ids)
+        matrix = _ratings_matrix(store, changed_users, 'user', movie_index)
+        user_factors[changed_positions] = solve_factors(matrix, item_factors, reg, n_jobs)
+
+    # Seen-item masks come straight from the updated store
+    columns = store.columns(['userId', 'movieId'])
+    all_users = user_index.get_indexer(columns.pop('userId'))
+    all_movies = movie_index.get_indexer(columns.pop('movieId'))
+    known = (all_users >= 0) & (all_movies >= 0)
+    seen = sparse.csr_matrix(
+        (np.ones(int(known.sum()), dtype=np.float32), (all_users[known], all_movies[known])),
+        shape=(len(user_ids), len(movie_ids)),
+    )
+    save_cf_artifacts(user_factors, item_factors, user_ids, movie_ids, seen, model_dir)
+    print(f"Folded in {len(changed_users)} users ({len(new_users)} new) and {len(new_movies)} new movies.")
+
+
+def run_incremental_update(ratings_delta=None, movies_delta=None, reg=0.1, n_jobs=-1):
+    new_movies = pd.read_csv(movies_delta) if movies_delta else None
+    if movies_delta:
+        append_delta(movies_delta, MOVIES_DELTA_LOG)
+
+    changed_users = np.empty(0, dtype=np.int64)
+    added = removed = None
+    if ratings_delta:
+        with stage_timer('incremental', 'read_delta'):
+            append_delta(ratings_delta, RATINGS_DELTA_LOG)
+            users, movie_ids, ratings_x2, timestamps = read_ratings_csv(ratings_delta)
+        with stage_timer('incremental', 'ratings_store', ratings=len(users)):
+            added, removed = apply_ratings_delta(users, movie_ids, ratings_x2, timestamps)
+        changed_users = np.unique(users).astype(np.int64)
+
+    if os.path.exists(os.path.join(ANALYTICS_DIR, 'movie_stats.pkl')):
+        with stage_timer('incremental', 'analytics'):
+            update_analytics_aggregates(added, removed, new_movies)
+
+    with stage_timer('incremental', 'catalog'):
+        add_new_movies(new_movies if new_movies is not None else pd.DataFrame(columns=['movieId', 'title', 'genres']))
+
+    if len(changed_users) and os.path.exists('models/user_factors.pkl'):
+        with stage_timer('incremental', 'cf_fold_in', users=len(changed_users)):
+            fold_in_ratings(changed_users, reg=reg, n_jobs=n_jobs)
+
+    # A new version is published even when only ratings changed: it carries the refreshed CF
+    # factors, and switching to it drops result-cache entries of the previous version
+    with stage_timer('incremental', 'publish_artifacts'):
+        publish_model_files()
+
+    # Only once the new version is live: merging the store's delta partitions into its sorted
+    # base costs a full rewrite, so it runs after enough deltas have piled up, not per delta
+    if ratings_delta:
+        with stage_timer('incremental', 'compact_ratings'):
+            compact_ratings_store()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply new ratings and movies without a full rebuild")
+    parser.add_argument('--ratings-delta', help="CSV with ratings.csv columns; re-ratings replace the stored value")
+    parser.add_argument('--movies-delta', help="CSV with movies.csv columns for movies added since the last build")
+    parser.add_argument('--reg', type=float, default=0.1, help="Regularization used when the CF model was trained")
+    parser.add_argument('--jobs', type=int, default=-1)
+    args = parser.parse_args()
+    if not args.ratings_delta and not args.movies_delta:
+        parser.error("nothing to apply; pass --ratings-delta and/or --movies-delta")
+    run_incremental_update(args.ratings_delta, args.movies_delta, reg=args.reg, n_jobs=args.jobs)
@@ -0,0 +1,130 @@
+import argparse
+import json
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+from artifact_store import ArtifactVersion, current_version
+from catalog import Catalog, compact_movies
+from metrics import build_info, peak_rss_bytes
+from ratings_store import CSV_DTYPES, RatingsStore, compact_ratings, load_ratings
+
+# Resident memory of the movie catalog and ratings frames as the app loads them before and after
+# the compact representations. Each scenario runs in a fresh process so freed memory held by
+# the allocator from an earlier scenario does not hide the difference.
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak RSS is the closest portable figure
+        return peak_rss_bytes()
+
+
+def _frame_bytes(frame):
+    return int(frame.memory_usage(deep=True).sum())
+
+
+def _catalog_bytes(catalog):
+    return int(sum(a.nbytes for a in vars(catalog).values() if isinstance(a, np.ndarray)))
+
+
+def movies_before():
+    movies = pd.read_pickle('data/enriched_movies.pkl')
+    return {'rows': len(movies), 'frame_bytes': _frame_bytes(movies)}, movies
+
+
+def movies_after():
+    movies = compact_movies(pd.read_pickle('data/enriched_movies.pkl'))
+    catalog = Catalog(movies)
+    return {'rows': len(movies), 'frame_bytes': _frame_bytes(movies) + _catalog_bytes(catalog)}, (movies, catalog)
+
+
+def movies_served():
+    # The catalog as the API holds it: the compact table published with the artifact version,
+    # without the list-column frame that movies_after parses and drops on the way
+    if current_version() is None:
+        return None, None
+    movies = ArtifactVersion().table('movies')
+    catalog = Catalog(movies)
+    return {'rows': len(movies), 'frame_bytes': _frame_bytes(movies) + _catalog_bytes(catalog)}, (movies, catalog)
+
+
+def ratings_before():
+    ratings = pd.read_csv('data/ratings.csv')
+    return {'rows': len(ratings), 'frame_bytes': _frame_bytes(ratings)}, ratings
+
+
+def ratings_after():
+    ratings = compact_ratings(pd.read_csv('data/ratings.csv', dtype=CSV_DTYPES))
+    return {'rows': len(ratings), 'frame_bytes': _frame_bytes(ratings)}, ratings
+
+
+def ratings_store():
+    if not RatingsStore.exists() and not os.path.exists('data/processed_ratings.pkl'):
+        return None, None
+    ratings = load_ratings()
+    return {'rows': len(ratings), 'frame_bytes': _frame_bytes(ratings)}, ratings
+
+
+SCENARIOS = {
+    'movies_before': movies_before,
+    'movies_after': movies_after,
+    'movies_served': movies_served,
+    'ratings_before': ratings_before,
+    'ratings_after': ratings_after,
+    'ratings_store': ratings_store,
+}
+
+
+def measure(name):
+    # Modules are imported before the baseline; on small samples the delta is still dominated by
+    # lazily initialised library state, so frame_bytes is the figure to compare there
+    baseline = rss_bytes()
+    result, loaded = SCENARIOS[name]()
+    if result is None:
+        return None
+    result['rss_bytes'] = rss_bytes() - baseline
+    del loaded
+    return result
+
+
+def run_report(names):
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        with context.Pool(1) as pool:
+            result = pool.apply(measure, (name,))
+        if result is None:
+            print(f"Skipping {name}: no input data.")
+            continue
+        results[name] = result
+
+    print(f"{'scenario':>16} {'rows':>10} {'frame MB':>10} {'RSS MB':>10}")
+    for name, result in results.items():
+        print(f"{name:>16} {result['rows']:>10} {result['frame_bytes'] / 2 ** 20:>10.1f} "
+              f"{result['rss_bytes'] / 2 ** 20:>10.1f}")
+    for before_name, after_name in (('movies_before', 'movies_served'), ('movies_before', 'movies_after'),
+                                    ('ratings_before', 'ratings_after'), ('ratings_before', 'ratings_store')):
+        before, after = results.get(before_name), results.get(after_name)
+        if before and after:
+            print(f"{before_name} -> {after_name}: frame {before['frame_bytes'] / after['frame_bytes']:.1f}x smaller, "
+                  f"RSS {before['rss_bytes'] / 2 ** 20:.1f} -> {after['rss_bytes'] / 2 ** 20:.1f} MB")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory footprint of the catalog and ratings frames")
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--output', default='bench/memory_report.json')
+    args = parser.parse_args()
+
+    results = run_report(args.scenarios)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'build': build_info(), 'results': results}, f, indent=2)
+    print(f"Results written to {args.output}")
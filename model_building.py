@@ -1,27 +1,136 @@
+import argparse
 import os
+import numpy as np
 import pandas as pd
 import joblib
-from sklearn.decomposition import TruncatedSVD
-from sklearn.preprocessing import MultiLabelBinarizer
 
-def build_models():
+from ann_index import IVFIndex
+from cf_model import als_fit, build_rating_matrix, save_cf_artifacts
+from content_features import GENOME_PATH, ContentFeaturePipeline
+from metrics import stage_timer
+from ratings_store import load_ratings
+from serving import publish_model_files
+from similarity import SimilarityEngine, l2_normalize, top_k
+
+NEIGHBOUR_K = 100
+
+def build_models(content_dims=64, feature_weights=None, genome_path=GENOME_PATH, genome_min_relevance=0.0):
+    build_content_models(content_dims, feature_weights, genome_path, genome_min_relevance)
+    build_cf_model()
+    with stage_timer('model_building', 'publish_artifacts'):
+        publish_model_files()
+
+def build_content_models(content_dims=64, feature_weights=None, genome_path=GENOME_PATH, genome_min_relevance=0.0):
     os.makedirs('models', exist_ok=True)
     movies = pd.read_pickle('data/enriched_movies.pkl')
 
     # Prepare genre data
     movies['genres'] = movies['genres'].apply(lambda gs: gs if isinstance(gs, list) else [])
 
-    mlb = MultiLabelBinarizer()
-    genre_matrix = pd.DataFrame(mlb.fit_transform(movies['genres']), columns=mlb.classes_, index=movies.index)
+    with stage_timer('model_building', 'content_embeddings', movies=len(movies), dims=content_dims):
+        pipeline = ContentFeaturePipeline(content_dims, feature_weights, genome_path=genome_path,
+                                          genome_min_relevance=genome_min_relevance)
+        content_embeddings = pipeline.fit_transform(movies)
+
+        # Save content embeddings, plus the fitted pipeline so new movies can be projected later
+        joblib.dump(content_embeddings, 'models/content_embeddings.pkl')
+        joblib.dump(pipeline, 'models/content_pipeline.pkl')
+
+    print("Content embeddings created and saved.")
+
+    with stage_timer('model_building', 'ann_index'):
+        build_ann_index(content_embeddings)
+    with stage_timer('model_building', 'neighbour_table'):
+        build_neighbour_table(content_embeddings)
 
-    n_components = min(50, genre_matrix.shape[1])
-    svd = TruncatedSVD(n_components=n_components, random_state=42)
-    content_embeddings = svd.fit_transform(genre_matrix)
+def build_ann_index(content_embeddings, n_lists=None):
+    index = IVFIndex.build(l2_normalize(content_embeddings), n_lists=n_lists)
+    index.save('models/ann_index.npz')
+    print(f"ANN index with {index.n_lists} lists created and saved.")
+    return index
+
+def build_neighbour_table(content_embeddings, k=NEIGHBOUR_K, block_size=1024):
+    engine = SimilarityEngine(content_embeddings)
+    n_movies = len(engine)
+    # Fixed-width rows padded with -1 / -inf when the catalog has fewer than k other movies
+    ids = np.lib.format.open_memmap('models/neighbour_ids.npy', mode='w+', dtype=np.int32, shape=(n_movies, k))
+    scores = np.lib.format.open_memmap('models/neighbour_scores.npy', mode='w+', dtype=np.float32, shape=(n_movies, k))
+    ids[:] = -1
+    scores[:] = -np.inf
+    for start in range(0, n_movies, block_size):
+        rows = np.arange(start, min(start + block_size, n_movies))
+        block_ids, block_scores = engine.most_similar(rows, k)
+        ids[rows, :block_ids.shape[1]] = block_ids
+        scores[rows, :block_scores.shape[1]] = block_scores
+    ids.flush()
+    scores.flush()
+    print(f"Top-{k} neighbour table for {n_movies} movies created and saved.")
+    return ids, scores
+
+def project_content_embeddings(movies, model_dir='models'):
+    # Embed movies added since the last full build with the saved feature pipeline; genres,
+    # people and tags it has never seen only count again after the next full build
+    pipeline = joblib.load(os.path.join(model_dir, 'content_pipeline.pkl'))
+    return pipeline.transform(movies)
+
+def extend_neighbour_table(content_embeddings, n_existing, block_size=1024):
+    # Rows [n_existing, N) are new movies. Existing rows only need the new movies merged into
+    # their top-k; new rows are scored against the whole catalog.
+    engine = SimilarityEngine(content_embeddings)
+    n_movies = len(engine)
+    old_ids = np.load('models/neighbour_ids.npy', mmap_mode='r')
+    old_scores = np.load('models/neighbour_scores.npy', mmap_mode='r')
+    k = old_ids.shape[1]
+    new_rows = np.arange(n_existing, n_movies)
+    # Written next to the live table and swapped in, so a process mapping the old file keeps it
+    ids = np.lib.format.open_memmap('models/neighbour_ids.tmp.npy', mode='w+', dtype=np.int32, shape=(n_movies, k))
+    scores = np.lib.format.open_memmap('models/neighbour_scores.tmp.npy', mode='w+', dtype=np.float32, shape=(n_movies, k))
+    ids[:] = -1
+    scores[:] = -np.inf
+    for start in range(0, n_existing, block_size):
+        rows = np.arange(start, min(start + block_size, n_existing))
+        new_scores = engine.normalized[rows] @ engine.normalized[new_rows].T
+        candidate_ids = np.concatenate([old_ids[rows], np.broadcast_to(new_rows, new_scores.shape)], axis=1)
+        candidate_scores = np.concatenate([old_scores[rows], new_scores], axis=1)
+        best = top_k(candidate_scores, k)
+        ids[rows] = np.take_along_axis(candidate_ids, best, axis=1)
+        scores[rows] = np.take_along_axis(candidate_scores, best, axis=1)
+    for start in range(n_existing, n_movies, block_size):
+        rows = np.arange(start, min(start + block_size, n_movies))
+        block_ids, block_scores = engine.most_similar(rows, k)
+        ids[rows, :block_ids.shape[1]] = block_ids
+        scores[rows, :block_scores.shape[1]] = block_scores
+    ids.flush()
+    scores.flush()
+    del ids, scores, old_ids, old_scores
+    os.replace('models/neighbour_ids.tmp.npy', 'models/neighbour_ids.npy')
+    os.replace('models/neighbour_scores.tmp.npy', 'models/neighbour_scores.npy')
+    print(f"Top-{k} neighbour table extended with {len(new_rows)} new movies.")
+    return np.load('models/neighbour_ids.npy', mmap_mode='r'), np.load('models/neighbour_scores.npy', mmap_mode='r')
+
+def build_cf_model(n_factors=64, reg=0.1, n_iter=10, n_jobs=-1):
+    os.makedirs('models', exist_ok=True)
+    with stage_timer('model_building', 'rating_matrix'):
+        ratings = load_ratings(['userId', 'movieId', 'rating'])
+        ratings_matrix, user_ids, movie_ids = build_rating_matrix(ratings)
+        del ratings
+    print(f"Ratings matrix: {ratings_matrix.shape[0]} users x {ratings_matrix.shape[1]} movies, {ratings_matrix.nnz} ratings")
 
-    # Save content embeddings
-    joblib.dump(content_embeddings, 'models/content_embeddings.pkl')
+    with stage_timer('model_building', 'als_fit', ratings=int(ratings_matrix.nnz), n_factors=n_factors, n_iter=n_iter):
+        user_factors, item_factors = als_fit(ratings_matrix, n_factors=n_factors, reg=reg, n_iter=n_iter, n_jobs=n_jobs)
+    with stage_timer('model_building', 'save_cf_artifacts'):
+        save_cf_artifacts(user_factors, item_factors, user_ids, movie_ids, ratings_matrix)
 
-    print("Genre-based content embeddings created and saved.")
+    print("Collaborative filtering factors created and saved.")
 
 if __name__ == "__main__":
-    build_models()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dims', type=int, default=64, help="Content embedding dimensionality")
+    parser.add_argument('--genome-path', default=GENOME_PATH, help="genome-scores.csv; skipped if the file is missing")
+    parser.add_argument('--genome-min-relevance', type=float, default=0.0,
+                        help="Drop genome scores at or below this relevance to keep the matrix sparser")
+    parser.add_argument('--weight', action='append', default=[], metavar='BLOCK=W',
+                        help="Feature block weight, e.g. --weight people=0.5 (blocks: genres, people, genome)")
+    args = parser.parse_args()
+    weights = {name: float(value) for name, value in (w.split('=', 1) for w in args.weight)}
+    build_models(args.dims, weights, args.genome_path, args.genome_min_relevance)
@@ -0,0 +1,327 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from content_features import GENOME_PATH
+from delta_log import MOVIES_DELTA_LOG, RATINGS_DELTA_LOG
+from metrics import peak_rss_bytes, stage_timer
+from ratings_store import store_is_current
+
+# Full rebuild as a graph of stages with declared inputs and outputs. A stage is skipped when the
+# content hashes of its inputs (data files and the modules that implement it), its parameters and
+# the hashes of its outputs all match the last successful run, so outputs rewritten elsewhere (e.g.
+# by incremental_update.py) are rebuilt; a stage whose upstream re-ran but produced identical files
+# is skipped too. Ready stages run side by side in separate processes.
+
+STATE_PATH = '.pipeline_state.json'
+RATINGS_PICKLE = 'data/processed_ratings.pkl'
+RATINGS_STORE = 'data/ratings_store'
+# Whichever of the pickle and the columnar store load_ratings reads, resolved when hashing
+RATINGS_SOURCE = 'ratings'
+CONTENT_OUTPUTS = [
+    'models/content_embeddings.pkl', 'models/ann_index.npz', 'models/neighbour_ids.npy', 'models/neighbour_scores.npy',
+]
+CF_OUTPUTS = [
+    'models/user_factors.pkl', 'models/item_factors.pkl', 'models/user_id_map.pkl',
+    'models/movie_id_map.pkl', 'models/seen_indptr.npy', 'models/seen_indices.npy',
+]
+
+
+def _module(name):
+    # Source files are inputs too, so a code change reruns the stages built on it
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name + '.py')
+
+
+class Stage:
+    def __init__(self, name, func, inputs, outputs, params=None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+
+
+# Stage bodies are module-level functions so worker processes can unpickle them by name
+def _ingest_movies():
+    from imdb_metadata_ingestion import ingest_movies
+    ingest_movies()
+
+
+def _ingest_ratings(streaming):
+    from imdb_metadata_ingestion import ingest_ratings
+    ingest_ratings(streaming)
+
+
+def _content_models(dims, weights, genome_path, genome_min_relevance):
+    from model_building import build_content_models
+    build_content_models(dims, weights, genome_path, genome_min_relevance)
+
+
+def _cf_model(n_factors, reg, n_iter):
+    from model_building import build_cf_model
+    build_cf_model(n_factors, reg, n_iter)
+
+
+def _publish():
+    from serving import publish_model_files
+    publish_model_files()
+
+
+def _analytics():
+    from analytics_aggregates import build_analytics_aggregates
+    build_analytics_aggregates()
+
+
+def _evaluate():
+    from evaluation import evaluate
+    with open('models/evaluation.json', 'w') as f:
+        json.dump({'rmse': evaluate()}, f)
+
+
+def build_stages(streaming=False, dims=64, weights=None, genome_path=GENOME_PATH, genome_min_relevance=0.0,
+                 n_factors=64, reg=0.1, n_iter=10):
+    ratings = RATINGS_SOURCE
+    return [
+        Stage('ingest_movies', _ingest_movies,
+              ['data/movies.csv', MOVIES_DELTA_LOG, 'data/imdb_metadata.pkl', _module('imdb_metadata_ingestion'),
+               _module('delta_log')],
+              ['data/enriched_movies.pkl']),
+        Stage('ingest_ratings', _ingest_ratings,
+              ['data/ratings.csv', RATINGS_DELTA_LOG, _module('imdb_metadata_ingestion'), _module('ratings_store'),
+               _module('delta_log')],
+              [ratings], {'streaming': streaming}),
+        Stage('content_models', _content_models,
+              ['data/enriched_movies.pkl', genome_path, _module('model_building'), _module('content_features'),
+               _module('ann_index')],
+              CONTENT_OUTPUTS + ['models/content_pipeline.pkl'],
+              {'dims': dims, 'weights': weights or {}, 'genome_path': genome_path,
+               'genome_min_relevance': genome_min_relevance}),
+        Stage('cf_model', _cf_model,
+              [ratings, _module('model_building'), _module('cf_model')],
+              CF_OUTPUTS, {'n_factors': n_factors, 'reg': reg, 'n_iter': n_iter}),
+        # Content and CF models are published together as one artifact version, whichever changed
+        Stage('publish', _publish,
+              ['data/enriched_movies.pkl'] + CONTENT_OUTPUTS + CF_OUTPUTS
+              + [_module(name) for name in ('serving', 'artifact_store', 'user_recs', 'catalog', 'title_index')],
+              ['models/artifacts/CURRENT']),
+        Stage('analytics', _analytics,
+              ['data/movies.csv', MOVIES_DELTA_LOG, ratings, _module('analytics_aggregates')],
+              ['data/analytics/summary.json', 'data/analytics/movie_stats.pkl', 'data/analytics/rating_hist.npy',
+               'data/analytics/genre_year_counts.pkl', 'data/analytics/genre_top.pkl']),
+        Stage('evaluate', _evaluate,
+              [ratings, _module('evaluation')] + CF_OUTPUTS,
+              ['models/evaluation.json']),
+    ]
+
+
+def dependencies(stages):
+    # A stage depends on every stage that writes one of its inputs (or a file inside an input directory)
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    return {
+        stage.name: {
+            producers[output] for path in stage.inputs for output in producers
+            if output == path or output.startswith(path.rstrip('/') + '/')
+        } - {stage.name}
+        for stage in stages
+    }
+
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {'files': {}, 'stages': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_hash(path, state, chunk_size=1 << 20):
+    # Hashes are reused while size and mtime are unchanged, so an unchanged ratings.csv is not re-read
+    stat = os.stat(path)
+    cached = state['files'].get(path)
+    if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached['sha256']
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    state['files'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+    return digest.hexdigest()
+
+
+def resolve_path(path):
+    if path == RATINGS_SOURCE:
+        return RATINGS_STORE if store_is_current(RATINGS_PICKLE) else RATINGS_PICKLE
+    return path
+
+
+def path_hash(path, state):
+    # None for a missing optional input (e.g. no genome scores); directories hash their file list
+    if not path or not os.path.exists(path):
+        return None
+    if not os.path.isdir(path):
+        return file_hash(path, state)
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(f"{os.path.relpath(file_path, path)}:{file_hash(file_path, state)}".encode())
+    return digest.hexdigest()
+
+
+def _hashes(paths, state):
+    # Keyed by the resolved path, so switching the ratings source changes the signature
+    return {resolve_path(path) or '': path_hash(resolve_path(path), state) for path in paths}
+
+
+def stage_signature(stage, state):
+    return {
+        'inputs': _hashes(stage.inputs, state),
+        'params': json.loads(json.dumps(stage.params, sort_keys=True)),
+    }
+
+
+def is_current(stage, signature, state):
+    previous = state['stages'].get(stage.name)
+    return (
+        previous is not None
+        and previous['inputs'] == signature['inputs']
+        and previous['params'] == signature['params']
+        and previous.get('outputs') == _hashes(stage.outputs, state)
+        and None not in previous['outputs'].values()
+    )
+
+
+def _run_stage(name, func, params):
+    # Runs in a fresh worker process, so the peak RSS belongs to this stage alone (ALS threads
+    # included); processes the stage starts and joins itself show up as the child peak
+    start = time.perf_counter()
+    with stage_timer('pipeline', name):
+        func(**params)
+    self_peak, child_peak = peak_rss_bytes(), peak_rss_bytes(children=True)
+    return {
+        'seconds': round(time.perf_counter() - start, 3),
+        'peak_rss_mb': None if self_peak is None else round(self_peak / 2 ** 20, 1),
+        'child_peak_rss_mb': None if child_peak is None else round(child_peak / 2 ** 20, 1),
+    }
+
+
+def select_stages(stages, names):
+    # Requested stages plus everything upstream of them; cached upstream stages are skipped anyway
+    if not names:
+        return stages
+    deps = dependencies(stages)
+    selected, pending = set(), list(names)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(deps[name])
+    return [stage for stage in stages if stage.name in selected]
+
+
+def run_pipeline(stages, max_workers=2, force=(), dry_run=False, state_path=STATE_PATH):
+    # force: names of stages to rerun even when their inputs are unchanged
+    state = load_state(state_path)
+    deps = dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    done, failed, results = set(), set(), {}
+    running = {}
+
+    if dry_run:
+        # Without running anything, a stage downstream of a stage that would run is assumed to change
+        dirty = set()
+        for stage in stages:
+            if stage.name in force or deps[stage.name] & dirty or not is_current(stage, stage_signature(stage, state), state):
+                dirty.add(stage.name)
+            print(f"{stage.name:>16}: {'run' if stage.name in dirty else 'skip'}")
+        return {}
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context, max_tasks_per_child=1) as pool:
+        while len(done) + len(failed) < len(stages):
+            blocked = [s for s in stages if s.name not in done | failed | set(running) and deps[s.name] & failed]
+            for stage in blocked:
+                failed.add(stage.name)
+                results[stage.name] = {'status': 'blocked'}
+                print(f"Pipeline stage {stage.name} not run: an upstream stage failed.")
+
+            ready = [s for s in stages if s.name not in done | failed | set(running) and deps[s.name] <= done]
+            for stage in ready:
+                signature = stage_signature(stage, state)
+                if stage.name not in force and is_current(stage, signature, state):
+                    done.add(stage.name)
+                    results[stage.name] = {'status': 'skipped'}
+                    print(f"Pipeline stage {stage.name} is up to date, skipped.")
+                    continue
+                running[stage.name] = (pool.submit(_run_stage, stage.name, stage.func, stage.params), signature)
+            if len(done) + len(failed) == len(stages):
+                break
+            if not running:
+                continue
+
+            finished, _ = wait([future for future, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name in [n for n, (future, _) in running.items() if future in finished]:
+                future, signature = running.pop(name)
+                try:
+                    stats = future.result()
+                except Exception as e:
+                    failed.add(name)
+                    results[name] = {'status': 'failed', 'error': repr(e)}
+                    print(f"Pipeline stage {name} failed: {e!r}")
+                    traceback.print_exc()
+                    continue
+                done.add(name)
+                results[name] = dict(stats, status='ran')
+                # Recorded per stage as it finishes, so a later failure does not force a rerun of this one
+                state['stages'][name] = dict(signature, outputs=_hashes(by_name[name].outputs, state),
+                                             finished_at=time.time(), **stats)
+                save_state(state, state_path)
+
+    save_state(state, state_path)
+    print(f"{'stage':>16} {'status':>8} {'seconds':>10} {'peak MB':>10} {'child MB':>10}")
+    for stage in stages:
+        result = results.get(stage.name, {})
+        print(f"{stage.name:>16} {result.get('status', ''):>8} {result.get('seconds', ''):>10} "
+              f"{result.get('peak_rss_mb') or '':>10} {result.get('child_peak_rss_mb') or '':>10}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild data and models, rerunning only stages whose inputs changed")
+    parser.add_argument('stages', nargs='*', help="Stages to bring up to date, with their upstream stages (default: all)")
+    parser.add_argument('--jobs', type=int, default=2, help="Stages run in parallel; each holds its own data in memory")
+    parser.add_argument('--force', action='store_true',
+                        help="Rerun the named stages (all stages if none are named) even if nothing changed")
+    parser.add_argument('--dry-run', action='store_true', help="Only print which stages would run")
+    parser.add_argument('--streaming', action='store_true', help="Ingest ratings into the columnar store")
+    parser.add_argument('--dims', type=int, default=64, help="Content embedding dimensionality")
+    parser.add_argument('--genome-path', default=GENOME_PATH)
+    parser.add_argument('--genome-min-relevance', type=float, default=0.0)
+    parser.add_argument('--weight', action='append', default=[], metavar='BLOCK=W',
+                        help="Content feature block weight, as for model_building.py")
+    parser.add_argument('--factors', type=int, default=64)
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+
+    weights = {name: float(value) for name, value in (w.split('=', 1) for w in args.weight)}
+    stages = build_stages(args.streaming, args.dims, weights, args.genome_path, args.genome_min_relevance,
+                          n_factors=args.factors, n_iter=args.iterations)
+    unknown = set(args.stages) - {stage.name for stage in stages}
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    force = set(args.stages or [stage.name for stage in stages]) if args.force else set()
+    results = run_pipeline(select_stages(stages, args.stages), args.jobs, force, args.dry_run)
+    if any(result['status'] in ('failed', 'blocked') for result in results.values()):
+        raise SystemExit(1)
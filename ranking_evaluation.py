@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from cf_model import als_fit
+from ratings_store import load_ratings
+from similarity import l2_normalize, top_k
+
+_STATE = {}
+
+
+def temporal_split(ratings, test_fraction=0.2):
+    # Each user's most recent test_fraction of ratings is held out; single-rating users stay in train
+    ratings = ratings.sort_values(['userId', 'timestamp'], kind='stable').reset_index(drop=True)
+    rank = ratings.groupby('userId').cumcount().to_numpy()
+    counts = ratings.groupby('userId')['userId'].transform('size').to_numpy()
+    n_train = np.maximum(1, np.ceil(counts * (1 - test_fraction))).astype(np.int64)
+    is_test = rank >= n_train
+    return ratings[~is_test], ratings[is_test]
+
+
+def _csr(frame, user_index, item_index, values):
+    return sparse.csr_matrix(
+        (values, (user_index.get_indexer(frame['userId']), item_index.get_indexer(frame['movieId']))),
+        shape=(len(user_index), len(item_index)),
+        dtype=np.float32,
+    )
+
+
+def _init_worker(state):
+    _STATE.update(state)
+
+
+def _score_block(start, stop):
+    user_vectors = _STATE['user_vectors'][start:stop]
+    scores = user_vectors @ _STATE['item_vectors'].T
+    train = _STATE['train'][start:stop]
+    scores[train.nonzero()] = -np.inf
+    k = _STATE['k']
+    recs = top_k(scores, k)
+
+    relevant = _STATE['relevant'][start:stop]
+    n_relevant = np.diff(relevant.indptr)
+    # Hits are matched on (row, item) keys against the sparse relevant entries, so no dense
+    # block x n_items copy sits next to the score block
+    n_items = relevant.shape[1]
+    rows = np.arange(stop - start, dtype=np.int64)
+    relevant_keys = np.repeat(rows, n_relevant) * n_items + relevant.indices
+    hits = np.isin(rows[:, None] * n_items + recs, relevant_keys)
+    has_relevant = n_relevant > 0
+
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = hits @ discounts
+    ideal = np.cumsum(discounts)[np.minimum(n_relevant, k) - 1]
+    hit_counts = hits.sum(axis=1)
+    return {
+        'users': int(has_relevant.sum()),
+        'precision': float((hit_counts / k)[has_relevant].sum()),
+        'recall': float((hit_counts / np.maximum(n_relevant, 1))[has_relevant].sum()),
+        'ndcg': float((dcg / np.where(has_relevant, ideal, 1.0))[has_relevant].sum()),
+        'recommended': np.unique(recs[has_relevant]),
+    }
+
+
+def ranking_metrics(user_vectors, item_vectors, train, relevant, k=10, block_size=1024, n_jobs=None):
+    state = {'user_vectors': user_vectors, 'item_vectors': item_vectors, 'train': train, 'relevant': relevant, 'k': k}
+    blocks = [(start, min(start + block_size, train.shape[0])) for start in range(0, train.shape[0], block_size)]
+    # Each worker receives the model once through the initializer, then scores user blocks
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(state,)) as pool:
+        results = list(pool.map(_score_block, *zip(*blocks)))
+
+    users = max(1, sum(r['users'] for r in results))
+    recommended = np.unique(np.concatenate([r['recommended'] for r in results]))
+    return {
+        f'precision@{k}': sum(r['precision'] for r in results) / users,
+        f'recall@{k}': sum(r['recall'] for r in results) / users,
+        f'ndcg@{k}': sum(r['ndcg'] for r in results) / users,
+        'coverage': len(recommended) / item_vectors.shape[0],
+        'users_evaluated': sum(r['users'] for r in results),
+    }
+
+
+def content_vectors(item_index, train):
+    movies = pd.read_pickle('data/enriched_movies.pkl')
+    embeddings = l2_normalize(joblib.load('models/content_embeddings.pkl'))
+    # Align content rows with the evaluation item index; movies without embeddings stay zero
+    rows = pd.Index(movies['movieId']).get_indexer(item_index)
+    item_vectors = np.zeros((len(item_index), embeddings.shape[1]), dtype=np.float32)
+    item_vectors[rows >= 0] = embeddings[rows[rows >= 0]]
+    # A user's profile is the rating-weighted mean of the movies they rated in train
+    profiles = train @ item_vectors
+    return l2_normalize(profiles), item_vectors
+
+
+def evaluate_rankings(k=10, test_fraction=0.2, relevance_threshold=4.0, n_factors=64, n_iter=10, n_jobs=None):
+    ratings = load_ratings()
+    train_df, test_df = temporal_split(ratings, test_fraction)
+    user_index = pd.Index(np.unique(ratings['userId']))
+    item_index = pd.Index(np.unique(train_df['movieId']))
+    test_df = test_df[test_df['movieId'].isin(item_index)]
+    relevant_df = test_df[test_df['rating'] >= relevance_threshold]
+
+    train = _csr(train_df, user_index, item_index, train_df['rating'].to_numpy(np.float32))
+    relevant = _csr(relevant_df, user_index, item_index, np.ones(len(relevant_df), dtype=np.float32))
+    print(f"Temporal split: {len(train_df)} train / {len(test_df)} test ratings, "
+          f"{relevant.nnz} relevant test items (rating >= {relevance_threshold})")
+
+    results = {}
+    user_vectors, item_vectors = content_vectors(item_index, train)
+    results['content'] = ranking_metrics(user_vectors, item_vectors, train, relevant, k, n_jobs=n_jobs)
+
+    # CF is refit on the train split only so held-out ratings never leak into the factors
+    user_factors, item_factors = als_fit(train, n_factors=n_factors, n_iter=n_iter, verbose=False)
+    results['cf'] = ranking_metrics(user_factors, item_factors, train, relevant, k, n_jobs=n_jobs)
+
+    for model, metrics in results.items():
+        print(f"{model:>8}: " + ", ".join(
+            f"{name} {value:.4f}" if isinstance(value, float) else f"{name} {value}" for name, value in metrics.items()
+        ))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Temporal-holdout ranking evaluation of the content and CF models")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--output', help="Write the metrics as JSON to this path")
+    args = parser.parse_args()
+    metrics = evaluate_rankings(k=args.k, test_fraction=args.test_fraction, n_jobs=args.jobs)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(metrics, f, indent=2)
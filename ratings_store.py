@@ -0,0 +1,388 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from delta_log import RATINGS_DELTA_LOG, logged_deltas
+
+RATINGS_STORE_DIR = 'data/ratings_store'
+# Incremental deltas land in small partitions under the store; they are merged into the sorted
+# base once they hold this fraction of its rows, or once there are this many of them
+PARTITIONS_DIR = 'deltas'
+COMPACT_FRACTION = 0.05
+COMPACT_PARTITIONS = 32
+STORE_COLUMNS = ('userId', 'movieId', 'rating_x2', 'timestamp')
+COLUMNS = ('userId', 'movieId', 'rating', 'timestamp')
+CSV_DTYPES = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32, 'timestamp': np.int64}
+# In-memory ratings frames: half-star ratings are exact in float32, and timestamps fit int32 until 2038
+FRAME_DTYPES = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32, 'timestamp': np.int32}
+
+
+def compact_ratings(ratings):
+    # 16 bytes per rating instead of 32 for the default int64/float64 frame
+    dtypes = {column: dtype for column, dtype in FRAME_DTYPES.items() if column in ratings.columns}
+    if 'timestamp' in dtypes and len(ratings) and ratings['timestamp'].max() > np.iinfo(np.int32).max:
+        dtypes['timestamp'] = np.int64
+    return ratings.astype(dtypes)
+
+
+def _compact_timestamps(timestamps):
+    # int32 unless this chunk has timestamps past 2038; concatenating with int64 chunks upcasts
+    if len(timestamps) and timestamps.max() > np.iinfo(np.int32).max:
+        return timestamps.astype(np.int64)
+    return timestamps.astype(np.int32)
+
+
+def _offsets(sorted_keys):
+    # Unique keys plus [start, stop) offsets into the sorted column arrays. The keys are already
+    # sorted, so run boundaries are enough; np.unique would sort a full copy again.
+    if not len(sorted_keys):
+        return np.empty(0, dtype=np.int32), np.zeros(1, dtype=np.int64)
+    starts = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+    starts = np.concatenate([[0], starts]).astype(np.int64)
+    return sorted_keys[starts].astype(np.int32), np.append(starts, len(sorted_keys))
+
+
+def read_ratings_csv(csv_paths, chunksize=2_000_000, verbose=False):
+    # Typed columns as the store holds them: int32 ids, half-star bytes, int32 timestamps.
+    # Several paths are read one after another into the same columns, in order.
+    if isinstance(csv_paths, str):
+        csv_paths = [csv_paths]
+    users, movies, ratings, timestamps = [], [], [], []
+    n_rows = 0
+    for csv_path in csv_paths:
+        for chunk in pd.read_csv(csv_path, dtype=CSV_DTYPES, chunksize=chunksize):
+            users.append(chunk['userId'].to_numpy(np.int32))
+            movies.append(chunk['movieId'].to_numpy(np.int32))
+            # Half-star ratings fit in one byte as rating * 2
+            ratings.append(np.rint(chunk['rating'].to_numpy() * 2).astype(np.uint8))
+            timestamps.append(_compact_timestamps(chunk['timestamp'].to_numpy()))
+            n_rows += len(chunk)
+            if verbose:
+                print(f"Read {n_rows} ratings...")
+    if not n_rows:
+        return (np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0, np.uint8), np.empty(0, np.int32))
+
+    # One column at a time, dropping its chunks right away, so the chunks and a full concatenated
+    # copy of every column are never alive together
+    columns = [users, movies, ratings, timestamps]
+    del users, movies, ratings, timestamps
+    for i in range(len(columns)):
+        columns[i] = np.concatenate(columns[i])
+    return tuple(columns)
+
+
+def ratings_csv_paths(csv_path='data/ratings.csv'):
+    # The base ratings file followed by every logged delta, oldest first
+    return [csv_path] + logged_deltas(RATINGS_DELTA_LOG)
+
+
+def read_ratings_frame(csv_path='data/ratings.csv'):
+    # One-shot counterpart of read_ratings_csv; a re-rating in a later delta replaces the earlier row
+    paths = ratings_csv_paths(csv_path)
+    ratings = pd.concat([pd.read_csv(path, dtype=CSV_DTYPES) for path in paths], ignore_index=True)
+    if len(paths) > 1:
+        ratings = ratings.drop_duplicates(['userId', 'movieId'], keep='last').reset_index(drop=True)
+    return compact_ratings(ratings)
+
+
+def ingest_ratings_chunked(csv_path='data/ratings.csv', out_dir=RATINGS_STORE_DIR, chunksize=2_000_000):
+    os.makedirs(out_dir, exist_ok=True)
+    paths = ratings_csv_paths(csv_path)
+    columns = read_ratings_csv(paths, chunksize, verbose=True)
+    # Only logged deltas can repeat a (userId, movieId) pair
+    n_ratings = write_ratings_store(*columns, out_dir, dedupe=len(paths) > 1)
+    print(f"Ratings store with {n_ratings} ratings written to {out_dir}.")
+
+
+def write_ratings_store(users, movies, ratings_x2, timestamps, out_dir=RATINGS_STORE_DIR, dedupe=False):
+    os.makedirs(out_dir, exist_ok=True)
+    # A freshly written base already holds everything; partitions from before would double-count
+    shutil.rmtree(os.path.join(out_dir, PARTITIONS_DIR), ignore_errors=True)
+    # lexsort is stable, so the rows of a repeated pair stay in input order and the last one wins
+    order = np.lexsort((users, movies)).astype(np.int32)
+    if dedupe and len(order):
+        sorted_movies, sorted_users = movies[order], users[order]
+        last = np.append((sorted_movies[1:] != sorted_movies[:-1]) | (sorted_users[1:] != sorted_users[:-1]), True)
+        del sorted_movies, sorted_users
+        order = order[last]
+    # Columns are permuted and saved one at a time, so only one sorted copy is alive at once
+    np.save(os.path.join(out_dir, 'rating_x2.npy'), ratings_x2[order])
+    np.save(os.path.join(out_dir, 'timestamp.npy'), timestamps[order])
+
+    sorted_movies = movies[order]
+    np.save(os.path.join(out_dir, 'movieId.npy'), sorted_movies)
+    movie_keys, movie_offsets = _offsets(sorted_movies)
+    del sorted_movies
+    np.save(os.path.join(out_dir, 'movie_keys.npy'), movie_keys)
+
+    sorted_users = users[order]
+    del order
+    np.save(os.path.join(out_dir, 'userId.npy'), sorted_users)
+
+    # Per-user access goes through a permutation of the movie-sorted rows
+    user_order = np.argsort(sorted_users, kind='stable').astype(np.int32)
+    user_keys, user_offsets = _offsets(sorted_users[user_order])
+    np.save(os.path.join(out_dir, 'user_order.npy'), user_order)
+    np.save(os.path.join(out_dir, 'user_keys.npy'), user_keys)
+    np.save(os.path.join(out_dir, 'user_offsets.npy'), user_offsets)
+    # Written last: its presence and mtime are what marks the store complete and current
+    np.save(os.path.join(out_dir, 'movie_offsets.npy'), movie_offsets)
+    return len(user_order)
+
+
+def _pair_keys(users, movies):
+    return (users.astype(np.int64) << 32) | movies.astype(np.int64)
+
+
+def _write_partition(out_dir, columns):
+    # Written under a hidden name and renamed, so readers never list a half-written partition
+    root = os.path.join(out_dir, PARTITIONS_DIR)
+    os.makedirs(root, exist_ok=True)
+    existing = [int(name) for name in os.listdir(root) if name.isdigit()]
+    name = f"{max(existing) + 1 if existing else 0:06d}"
+    tmp_dir = os.path.join(root, f".tmp-{name}")
+    os.makedirs(tmp_dir, exist_ok=True)
+    for column, array in columns.items():
+        np.save(os.path.join(tmp_dir, f'{column}.npy'), array)
+    os.rename(tmp_dir, os.path.join(root, name))
+    return os.path.join(root, name)
+
+
+def apply_ratings_delta(users, movies, ratings_x2, timestamps, out_dir=RATINGS_STORE_DIR,
+                        pickle_path='data/processed_ratings.pkl'):
+    # The delta becomes a new partition of the store, so applying it costs the size of the delta,
+    # not of the store. A (userId, movieId) pair that is already rated is a re-rating and replaces
+    # the old row for every reader. Returns (movieId, rating_x2) of the rows added and of the rows
+    # they replaced, so callers can adjust aggregates without rescanning the store.
+    if not store_is_current(pickle_path):
+        # One-off conversion while the one-shot pickle is the current source
+        frame = pd.read_pickle(pickle_path)
+        write_ratings_store(
+            frame['userId'].to_numpy(np.int32),
+            frame['movieId'].to_numpy(np.int32),
+            np.rint(frame['rating'].to_numpy() * 2).astype(np.uint8),
+            _compact_timestamps(frame['timestamp'].to_numpy()),
+            out_dir,
+        )
+        del frame
+
+    # Within the delta the last row for a pair wins
+    delta_keys = _pair_keys(users, movies)
+    _, last = np.unique(delta_keys[::-1], return_index=True)
+    keep = np.sort(len(delta_keys) - 1 - last)
+    users, movies, ratings_x2, timestamps = users[keep], movies[keep], ratings_x2[keep], timestamps[keep]
+
+    store = RatingsStore(out_dir)
+    previous = store.current_ratings(users, movies)
+    replaced = previous > 0
+    removed = (movies[replaced], previous[replaced])
+    if len(users):
+        path = _write_partition(out_dir, dict(zip(STORE_COLUMNS, (users, movies, ratings_x2, timestamps))))
+        print(f"Applied {len(users)} ratings ({int(replaced.sum())} replaced existing ones) as partition {path}.")
+    return (movies, ratings_x2), removed
+
+
+def compact_ratings_store(out_dir=RATINGS_STORE_DIR, force=False):
+    # Merges the delta partitions into a new sorted base once they pass the thresholds. The new
+    # store is written beside the old one and swapped in with renames, so readers that mapped
+    # the old files keep valid pages. Returns whether it compacted.
+    store = RatingsStore(out_dir)
+    n_delta = sum(len(part['userId']) for part in store.partitions)
+    if not store.partitions or not force and (
+            n_delta < COMPACT_FRACTION * len(store.array('movieId')) and len(store.partitions) < COMPACT_PARTITIONS):
+        return False
+    n_partitions = len(store.partitions)
+    columns = store.columns()
+    del store
+    tmp_dir, old_dir = out_dir.rstrip('/') + '.compact', out_dir.rstrip('/') + '.old'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    n_ratings = write_ratings_store(*(columns.pop(name) for name in STORE_COLUMNS), tmp_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    os.rename(out_dir, old_dir)
+    os.rename(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"Compacted {n_partitions} delta partitions ({n_delta} ratings) into {out_dir}: {n_ratings} ratings.")
+    return True
+
+
+# The sorted base columns plus small delta partitions in arrival order. A (userId, movieId) pair
+# in a partition replaces the same pair in the base and in earlier partitions. array(),
+# movie_range(), user_rows() and rating() address base rows only; everything else merges.
+class RatingsStore:
+    def __init__(self, path=RATINGS_STORE_DIR, mmap_mode='r'):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self._arrays = {}
+        self._partitions = None
+        self._live = None
+
+    @staticmethod
+    def exists(path=RATINGS_STORE_DIR):
+        return os.path.exists(os.path.join(path, 'movie_offsets.npy'))
+
+    def array(self, name):
+        # Columns are opened lazily so callers only map what they touch
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode=self.mmap_mode)
+        return self._arrays[name]
+
+    @property
+    def partitions(self):
+        # Oldest first, each as a dict of its columns; deltas are small enough to read whole
+        if self._partitions is None:
+            root = os.path.join(self.path, PARTITIONS_DIR)
+            names = sorted(name for name in os.listdir(root) if name.isdigit()) if os.path.isdir(root) else []
+            self._partitions = [
+                {column: np.load(os.path.join(root, name, f'{column}.npy')) for column in STORE_COLUMNS}
+                for name in names
+            ]
+        return self._partitions
+
+    def live_rows(self):
+        # (sorted base rows replaced by a partition, per partition a mask of rows no later one replaces)
+        if self._live is None:
+            masks, later = [], np.empty(0, dtype=np.int64)
+            for part in reversed(self.partitions):
+                keys = _pair_keys(part['userId'], part['movieId'])
+                masks.append(~np.isin(keys, later))
+                later = np.union1d(later, keys)
+            rows = self.find_rows((later >> 32).astype(np.int32), (later & 0xFFFFFFFF).astype(np.int32))
+            self._live = (np.sort(rows[rows >= 0]), masks[::-1])
+        return self._live
+
+    def find_rows(self, users, movies):
+        # Base row of each (userId, movieId) pair, -1 when absent. Rows of one movie are sorted by
+        # user, so this is one vectorized binary search inside every pair's movie range.
+        users, movies = np.asarray(users), np.asarray(movies)
+        rows = np.full(len(users), -1, dtype=np.int64)
+        keys = self.array('movie_keys')
+        if not len(keys) or not len(users):
+            return rows
+        pos = np.minimum(np.searchsorted(keys, movies), len(keys) - 1)
+        found = keys[pos] == movies
+        offsets = self.array('movie_offsets')
+        lo = np.where(found, offsets[pos], 0).astype(np.int64)
+        hi = np.where(found, offsets[pos + 1], 0).astype(np.int64)
+        stop = hi.copy()
+        base_users = self.array('userId')
+        active = lo < hi
+        while active.any():
+            mid = (lo + hi) // 2
+            below = np.zeros(len(users), dtype=bool)
+            below[active] = base_users[mid[active]] < users[active]
+            lo = np.where(active & below, mid + 1, lo)
+            hi = np.where(active & ~below, mid, hi)
+            active = lo < hi
+        hit = lo < stop
+        hit[hit] = base_users[lo[hit]] == users[hit]
+        rows[hit] = lo[hit]
+        return rows
+
+    def current_ratings(self, users, movies):
+        # rating_x2 each pair has now, 0 where it has none; later partitions overwrite earlier ones
+        result = np.zeros(len(users), dtype=np.uint8)
+        rows = self.find_rows(users, movies)
+        result[rows >= 0] = self.array('rating_x2')[rows[rows >= 0]]
+        keys = _pair_keys(users, movies)
+        for part in self.partitions:
+            part_keys = _pair_keys(part['userId'], part['movieId'])
+            order = np.argsort(part_keys)
+            pos = np.minimum(np.searchsorted(part_keys[order], keys), len(part_keys) - 1)
+            hit = part_keys[order[pos]] == keys
+            result[hit] = part['rating_x2'][order[pos[hit]]]
+        return result
+
+    def __len__(self):
+        replaced, masks = self.live_rows()
+        return len(self.array('movieId')) - len(replaced) + sum(int(mask.sum()) for mask in masks)
+
+    def rating(self, rows=slice(None)):
+        return self.array('rating_x2')[rows].astype(np.float32) / 2
+
+    def movie_range(self, movie_id):
+        keys = self.array('movie_keys')
+        pos = np.searchsorted(keys, movie_id)
+        if pos == len(keys) or keys[pos] != movie_id:
+            return slice(0, 0)
+        offsets = self.array('movie_offsets')
+        return slice(int(offsets[pos]), int(offsets[pos + 1]))
+
+    def user_rows(self, user_id):
+        keys = self.array('user_keys')
+        pos = np.searchsorted(keys, user_id)
+        if pos == len(keys) or keys[pos] != user_id:
+            return np.empty(0, dtype=np.int32)
+        offsets = self.array('user_offsets')
+        return np.asarray(self.array('user_order')[offsets[pos]:offsets[pos + 1]])
+
+    def columns(self, names=STORE_COLUMNS):
+        # Whole columns with the partitions merged in: surviving base rows first, then partition rows
+        if not self.partitions:
+            return {name: np.asarray(self.array(name)) for name in names}
+        replaced, masks = self.live_rows()
+        keep = np.ones(len(self.array('movieId')), dtype=bool)
+        keep[replaced] = False
+        return {
+            name: np.concatenate([self.array(name)[keep]] + [part[name][mask] for part, mask in zip(self.partitions, masks)])
+            for name in names
+        }
+
+    def unique(self, name):
+        # Sorted distinct userIds or movieIds. A re-rating never removes a pair, so the union is exact.
+        keys = np.asarray(self.array('user_keys' if name == 'userId' else 'movie_keys'))
+        if not self.partitions:
+            return keys
+        return np.union1d(keys, np.concatenate([part[name] for part in self.partitions]))
+
+    def ratings_for(self, name, ids):
+        # Every current rating of the given userIds (name='userId') or movieIds ('movieId'):
+        # (position of the owner in ids, dict of the rows' columns)
+        if name == 'userId':
+            chunks = [self.user_rows(i) for i in ids]
+        else:
+            chunks = [np.arange(r.start, r.stop) for r in map(self.movie_range, ids)]
+        owner = np.repeat(np.arange(len(ids)), [len(chunk) for chunk in chunks])
+        rows = np.concatenate(chunks).astype(np.int64) if chunks else np.empty(0, dtype=np.int64)
+        replaced, masks = self.live_rows()
+        keep = ~np.isin(rows, replaced)
+        owners, columns = [owner[keep]], {column: [self.array(column)[rows[keep]]] for column in STORE_COLUMNS}
+        index = pd.Index(ids)
+        for part, mask in zip(self.partitions, masks):
+            pos = index.get_indexer(part[name])
+            hit = mask & (pos >= 0)
+            owners.append(pos[hit])
+            for column in STORE_COLUMNS:
+                columns[column].append(part[column][hit])
+        return np.concatenate(owners), {column: np.concatenate(arrays) for column, arrays in columns.items()}
+
+    def ratings_for_movie(self, movie_id):
+        _, columns = self.ratings_for('movieId', [movie_id])
+        return pd.DataFrame({
+            'userId': columns['userId'],
+            'movieId': columns['movieId'],
+            'rating': columns['rating_x2'].astype(np.float32) / 2,
+            'timestamp': columns['timestamp'],
+        })
+
+    def to_frame(self, columns=COLUMNS):
+        data = self.columns(['rating_x2' if column == 'rating' else column for column in columns])
+        return pd.DataFrame({
+            column: data['rating_x2'].astype(np.float32) / 2 if column == 'rating' else data[column]
+            for column in columns
+        })
+
+
+def store_is_current(pickle_path='data/processed_ratings.pkl'):
+    # Use whichever of the columnar store and the one-shot pickle was written last
+    return RatingsStore.exists() and (
+        not os.path.exists(pickle_path)
+        or os.path.getmtime(os.path.join(RATINGS_STORE_DIR, 'movie_offsets.npy')) >= os.path.getmtime(pickle_path)
+    )
+
+
+def load_ratings(columns=COLUMNS, pickle_path='data/processed_ratings.pkl'):
+    if store_is_current(pickle_path):
+        return RatingsStore().to_frame(columns)
+    return compact_ratings(pd.read_pickle(pickle_path)[list(columns)])
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    # In-process LRU with a per-entry TTL; expired entries are dropped lazily on access
+    def __init__(self, max_entries=10000, ttl_seconds=300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class InMemorySharedBackend:
+    # Local stand-in for a cache shared between workers (e.g. Redis or memcached).
+    # Anything with the same get/set(key, value, ttl) interface can replace it.
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                return None
+            return entry[1]
+
+    def set(self, key, value, ttl_seconds):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_seconds, value)
+
+
+class ResultCache:
+    # Caches ranked result lists. Keys carry the model version, so entries from a previous
+    # version are simply never looked up again after a swap and age out of the LRU.
+    # Each entry remembers the depth it was computed at and serves any request up to it.
+    def __init__(self, local=None, shared=None, min_depth=20):
+        self.local = local if local is not None else LRUCache()
+        self.shared = shared
+        self.min_depth = min_depth
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    def depth_for(self, n):
+        # Fill entries a little deeper than asked so later larger-n requests can hit
+        return max(n, self.min_depth)
+
+    @staticmethod
+    def _covers(entry, n):
+        depth, results = entry
+        # A short list means the catalog ran out, so it answers any depth
+        return depth >= n or len(results) < depth
+
+    def get(self, key, n):
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self.shared_hits += 1
+                self.local.set(key, entry)
+        if entry is not None and self._covers(entry, n):
+            self.hits += 1
+            return entry[1][:max(n, 0)]
+        self.misses += 1
+        return None
+
+    def set(self, key, depth, results):
+        entry = (depth, results)
+        self.local.set(key, entry)
+        if self.shared is not None:
+            self.shared.set(key, entry, self.local.ttl_seconds)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.local),
+            "max_entries": self.local.max_entries,
+            "ttl_seconds": self.local.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "evictions": self.local.evictions,
+            "expirations": self.local.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
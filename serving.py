@@ -0,0 +1,255 @@
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from ann_index import IVFIndex
+from artifact_store import ArtifactVersion, current_version, publish_artifacts
+from catalog import Catalog, compact_movies
+from metrics import timed
+from similarity import SimilarityEngine, l2_normalize
+from title_index import TitleIndex
+from user_recs import CF_ARRAYS, UserRecommender
+
+DEFAULT_NPROBE = int(os.environ.get('ANN_NPROBE', 8))
+
+
+def prepare_movies(movies):
+    # Serving-side metadata: lowercased titles for lookups and the compact catalog layout
+    movies = movies.copy()
+    movies['title'] = movies['title'].str.lower().str.strip()
+    return compact_movies(movies)
+
+
+# Everything one model version needs to answer requests. Handlers take a reference once per
+# request, so swapping the module-level state never changes data under an in-flight request.
+class ServingState:
+    def __init__(self, movies, engine, title_index, ann_index=None, neighbour_ids=None, neighbour_scores=None,
+                 user_recommender=None, version=None):
+        # Older artifact versions carry object columns; compacting an already compact frame is cheap
+        movies = compact_movies(movies)
+        self.movies = movies
+        self.catalog = Catalog(movies)
+        self.engine = engine
+        self.title_index = title_index
+        self.ann_index = ann_index
+        self.neighbour_ids = neighbour_ids
+        self.neighbour_scores = neighbour_scores
+        self.user_recommender = user_recommender
+        self.version = version
+        # Display columns as plain arrays so building a response never touches DataFrame rows
+        self.display_titles = movies['title'].str.title().to_numpy(dtype=object)
+        self.genres_strs = self.catalog.genres_strs
+        # One boolean mask per genre, built once so a filter is a few vector ops; years use 0 for
+        # unknown, so such movies never pass a year filter
+        self.genre_masks = {genre.lower(): self.catalog.genre_mask(genre) for genre in self.catalog.genre_names}
+        self.years = self.catalog.years
+        # CF item order -> catalog row (-1 when the catalog lacks the movie), for filtering user recs
+        self.cf_rows = None
+        if user_recommender is not None:
+            self.cf_rows = self.catalog.rows_for(user_recommender.movie_ids)
+
+    @classmethod
+    def from_legacy_files(cls):
+        movies = prepare_movies(pd.read_pickle('data/enriched_movies.pkl'))
+        content_embeddings = joblib.load('models/content_embeddings.pkl')
+        ann_index = IVFIndex.load('models/ann_index.npz') if os.path.exists('models/ann_index.npz') else None
+        if os.path.exists('models/neighbour_ids.npy'):
+            neighbour_ids = np.load('models/neighbour_ids.npy', mmap_mode='r')
+            neighbour_scores = np.load('models/neighbour_scores.npy', mmap_mode='r')
+        else:
+            neighbour_ids = neighbour_scores = None
+        return cls(
+            movies,
+            SimilarityEngine(content_embeddings),
+            TitleIndex(movies['title'].tolist()),
+            ann_index,
+            neighbour_ids,
+            neighbour_scores,
+            UserRecommender.from_files() if UserRecommender.available() else None,
+            version='legacy',
+        )
+
+    @classmethod
+    def from_artifacts(cls, version=None, verify_checksums=False):
+        artifacts = ArtifactVersion(version, verify_checksums=verify_checksums)
+        ann_index = None
+        if artifacts.has('ann_centroids'):
+            ann_index = IVFIndex(
+                artifacts.array('ann_centroids'),
+                artifacts.array('ann_list_offsets'),
+                artifacts.array('ann_list_items'),
+                artifacts.array('ann_list_vectors'),
+            )
+        return cls(
+            artifacts.table('movies'),
+            SimilarityEngine.from_normalized(artifacts.array('embeddings')),
+            artifacts.table('title_index'),
+            ann_index,
+            artifacts.array('neighbour_ids'),
+            artifacts.array('neighbour_scores'),
+            # Only the CF model published with this version; never the files under models/
+            UserRecommender.from_artifacts(artifacts) if artifacts.has(CF_ARRAYS[0]) else None,
+            version=artifacts.version,
+        )
+
+    def filter_mask(self, genre=None, year_min=None, year_max=None, exclude_ids=None):
+        # Catalog rows allowed by the filters, or None when nothing is filtered
+        if genre is None and year_min is None and year_max is None and not exclude_ids:
+            return None
+        mask = np.ones(len(self.movies), dtype=bool)
+        if genre is not None:
+            genre_mask = self.genre_masks.get(genre.strip().lower())
+            if genre_mask is None:
+                raise KeyError(genre)
+            mask &= genre_mask
+        if year_min is not None:
+            mask &= self.years >= year_min
+        if year_max is not None:
+            mask &= (self.years <= year_max) & (self.years > 0)
+        if exclude_ids:
+            rows = self.catalog.rows_for(list(exclude_ids))
+            mask[rows[rows >= 0]] = False
+        return mask
+
+    def cf_mask(self, mask):
+        # Catalog-row filter -> the CF model's item order; items missing from the catalog are dropped
+        if mask is None or self.cf_rows is None:
+            return None
+        return np.where(self.cf_rows >= 0, mask[np.maximum(self.cf_rows, 0)], False)
+
+    def find_movie_row(self, title):
+        return self.title_index.resolve(title)
+
+    def build_recommendations(self, indices, scores):
+        keep = np.isfinite(scores)
+        indices = np.asarray(indices)[keep]
+        scores = np.round(np.asarray(scores, dtype=np.float64)[keep], 4).tolist()
+        return [
+            {
+                "title": title,
+                "genres": genres,
+                "director": "Unknown",
+                "actors": "Unknown",
+                "similarity": score
+            }
+            for title, genres, score in zip(self.display_titles[indices], self.genres_strs[indices], scores)
+        ]
+
+    def build_user_recommendations(self, movie_ids, scores):
+        recommendations = []
+        rows = self.catalog.rows_for(movie_ids)
+        for movie_id, row, score in zip(movie_ids, rows, scores):
+            if not np.isfinite(score):
+                continue
+            if row < 0:
+                title, genres_str = "Unknown", ""
+            else:
+                title, genres_str = self.display_titles[row], self.genres_strs[row]
+            recommendations.append({
+                "movieId": int(movie_id),
+                "title": title,
+                "genres": genres_str,
+                "score": round(float(score), 4)
+            })
+        return recommendations
+
+    def needs_live_scoring(self, n, mode):
+        if self.neighbour_ids is not None and n <= self.neighbour_ids.shape[1]:
+            return False
+        return mode == "exact" or self.ann_index is None
+
+    def _filtered_table(self, rows, n, mask):
+        # Keep the table entries that pass the mask, in order. Returns None when some row has
+        # fewer than n survivors but the catalog could hold more, so live scoring must decide.
+        ids = np.asarray(self.neighbour_ids[rows])
+        scores = np.asarray(self.neighbour_scores[rows])
+        passes = (ids >= 0) & mask[np.maximum(ids, 0)]
+        full_width = (ids >= 0).all(axis=1)
+        if ((passes.sum(axis=1) < n) & full_width).any():
+            return None
+        # Stable sort puts passing entries first without disturbing their rank order
+        order = np.argsort(~passes, axis=1, kind='stable')[:, :n]
+        scores = np.where(np.take_along_axis(passes, order, axis=1), np.take_along_axis(scores, order, axis=1), -np.inf)
+        return np.take_along_axis(ids, order, axis=1), scores
+
+    def most_similar(self, rows, n, mode="ann", nprobe=None, timings=None, mask=None):
+        # The table holds exact results, so it serves both modes whenever it is deep enough
+        if self.neighbour_ids is not None and n <= self.neighbour_ids.shape[1]:
+            with timed(timings, "neighbour_table"):
+                rows = np.asarray(rows)
+                if mask is None:
+                    return self.neighbour_ids[rows, :max(n, 0)], self.neighbour_scores[rows, :max(n, 0)]
+                result = self._filtered_table(rows, max(n, 0), mask)
+            if result is not None:
+                return result
+        if mode == "exact" or self.ann_index is None:
+            return self.engine.most_similar(rows, n, timings, mask)
+        nprobe = nprobe or DEFAULT_NPROBE
+        n = max(0, min(n, len(self.engine) - 1))
+        indices = np.zeros((len(rows), n), dtype=np.int64)
+        scores = np.full((len(rows), n), -np.inf, dtype=np.float32)
+        for i, row in enumerate(rows):
+            found, sims = self.ann_index.search(self.engine.normalized[row], n, nprobe=nprobe, exclude=row,
+                                                timings=timings, mask=mask)
+            # A probe can return fewer than n candidates; the -inf padding is skipped later
+            indices[i, :len(found)] = found
+            scores[i, :len(found)] = sims
+        short = ~np.isfinite(scores).all(axis=1)
+        if short.any():
+            # Small lists, a low nprobe or a selective filter can leave the probed lists short;
+            # rescan those rows exactly rather than return fewer results than the catalog holds
+            exact_indices, exact_scores = self.engine.most_similar(np.asarray(rows)[short], n, timings, mask)
+            indices[short], scores[short] = exact_indices, exact_scores
+        return indices, scores
+
+
+def load_state():
+    # Published artifact versions are memory-mapped; older trees without them use the pickles
+    if current_version() is not None:
+        return ServingState.from_artifacts(verify_checksums=os.environ.get('ARTIFACT_VERIFY', '0') == '1')
+    return ServingState.from_legacy_files()
+
+
+def publish_serving_artifacts(movies, content_embeddings, ann_index=None, neighbour_ids=None, neighbour_scores=None,
+                              user_recommender=None):
+    movies = prepare_movies(movies)
+    arrays = {
+        'embeddings': l2_normalize(content_embeddings),
+        'neighbour_ids': neighbour_ids,
+        'neighbour_scores': neighbour_scores,
+    }
+    if ann_index is not None:
+        arrays.update({
+            'ann_centroids': ann_index.centroids,
+            'ann_list_offsets': ann_index.list_offsets,
+            'ann_list_items': ann_index.list_items,
+            'ann_list_vectors': ann_index.list_vectors,
+        })
+    if user_recommender is not None:
+        arrays.update(user_recommender.arrays())
+    # The title index is pickled with the version so workers skip rebuilding trigram postings
+    tables = {'movies': movies, 'title_index': TitleIndex(movies['title'].tolist())}
+    return publish_artifacts(arrays, tables)
+
+
+def publish_model_files():
+    # One version from what the content and CF builds leave in data/ and models/, so both models
+    # are always served from the same version and retraining either one publishes a new version
+    movies = pd.read_pickle('data/enriched_movies.pkl')
+    movies['genres'] = movies['genres'].apply(lambda gs: gs if isinstance(gs, list) else [])
+    ann_index = IVFIndex.load('models/ann_index.npz') if os.path.exists('models/ann_index.npz') else None
+    if os.path.exists('models/neighbour_ids.npy'):
+        neighbour_ids = np.load('models/neighbour_ids.npy', mmap_mode='r')
+        neighbour_scores = np.load('models/neighbour_scores.npy', mmap_mode='r')
+    else:
+        neighbour_ids = neighbour_scores = None
+    return publish_serving_artifacts(
+        movies,
+        joblib.load('models/content_embeddings.pkl'),
+        ann_index,
+        neighbour_ids,
+        neighbour_scores,
+        UserRecommender.from_files() if UserRecommender.available() else None,
+    )
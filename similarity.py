@@ -0,0 +1,66 @@
+import numpy as np
+
+from metrics import timed
+
+
+def l2_normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    # Zero vectors stay zero so they score 0 against everything, like cosine_similarity
+    norms[norms == 0] = 1.0
+    normalized = embeddings / norms
+    return np.nan_to_num(normalized, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def top_k(scores, k):
+    # Partial selection on the last axis, then sort only the k winners
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < scores.shape[-1]:
+        idx = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        idx = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=-1), axis=-1, kind='stable')
+    return np.take_along_axis(idx, order, axis=-1)
+
+
+class SimilarityEngine:
+    def __init__(self, embeddings):
+        self.normalized = l2_normalize(embeddings)
+
+    @classmethod
+    def from_normalized(cls, normalized):
+        # Reuse already-normalized (possibly memory-mapped) rows without copying them
+        engine = cls.__new__(cls)
+        engine.normalized = normalized
+        return engine
+
+    def __len__(self):
+        return self.normalized.shape[0]
+
+    def score(self, rows):
+        # One matmul for every seed row: shape (len(rows), n_items)
+        return self.normalized[rows] @ self.normalized.T
+
+    def most_similar(self, rows, n, timings=None, mask=None, block_size=256):
+        # Seeds are scored block_size at a time, so a large batch never holds more than
+        # block_size x n_items scores (64 MB for a 62k catalog) at once
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        n = min(n, len(self) - 1)
+        indices = np.empty((len(rows), max(n, 0)), dtype=np.int64)
+        top_scores = np.empty((len(rows), max(n, 0)), dtype=np.float32)
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            with timed(timings, "score"):
+                scores = self.score(block)
+                # Never recommend the seed movie itself
+                scores[np.arange(len(block)), block] = -np.inf
+                if mask is not None:
+                    # Filtered-out items can never win the top-k; callers drop the -inf tail
+                    scores[:, ~mask] = -np.inf
+            with timed(timings, "topk"):
+                idx = top_k(scores, n)
+                indices[start:start + len(block)] = idx
+                top_scores[start:start + len(block)] = np.take_along_axis(scores, idx, axis=1)
+        return indices, top_scores
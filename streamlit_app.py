@@ -4,13 +4,10 @@ import requests
 import altair as alt
 import re
 
-st.set_page_config(page_title="MovieLens Movie Recommender", layout="wide")
+from analytics_aggregates import load_analytics_aggregates
+from catalog import Catalog, compact_movies
 
-# Load data
-movies = pd.read_pickle('data/enriched_movies.pkl')
-ratings = pd.read_pickle('data/processed_ratings.pkl')
-movies_csv = pd.read_csv('data/movies.csv')
-movie_titles = sorted(movies['title'].dropna().unique())
+st.set_page_config(page_title="MovieLens Movie Recommender", layout="wide")
 
 def normalize_title(title):
     if pd.isna(title):
@@ -19,6 +16,50 @@ def normalize_title(title):
     s = re.sub(r'\s+', ' ', s)
     return s
 
+# Load data once per server process; reruns on widget interaction reuse the cached objects
+@st.cache_resource
+def load_movies():
+    # Compact frame (categoricals, joined genre strings); the list-column pickle is dropped after load
+    return compact_movies(pd.read_pickle('data/enriched_movies.pkl'))
+
+@st.cache_resource
+def load_catalog():
+    return Catalog(load_movies())
+
+@st.cache_resource
+def load_aggregates():
+    aggregates = load_analytics_aggregates()
+    movie_stats = aggregates['movie_stats']
+    aggregates['stats_row'] = pd.Series(range(len(movie_stats)), index=movie_stats['movieId'])
+    aggregates['title_to_movie_id'] = dict(zip(movie_stats['title'].map(normalize_title), movie_stats['movieId']))
+    aggregates['rated_stats'] = movie_stats[movie_stats['rating_count'] > 0]
+    return aggregates
+
+@st.cache_resource
+def load_movie_titles():
+    movies = load_movies()
+    titles = movies['title'].to_numpy(dtype=object)
+    # Title -> first catalog row, so a selection never scans the frame
+    title_rows = {}
+    for row, title in enumerate(titles):
+        title_rows.setdefault(title, row)
+    return sorted(title_rows), title_rows
+
+movies = load_movies()
+catalog = load_catalog()
+aggregates = load_aggregates()
+movie_titles, title_rows = load_movie_titles()
+
+def lookup_movie_id(title):
+    movie_id = aggregates['title_to_movie_id'].get(normalize_title(title))
+    if movie_id is None and title in title_rows:
+        movie_id = int(catalog.movie_ids[title_rows[title]])
+    return movie_id
+
+def stats_for_movie(movie_id):
+    row = aggregates['stats_row'].get(movie_id)
+    return None if row is None else aggregates['movie_stats'].iloc[row]
+
 # Sidebar navigation
 st.sidebar.title("Navigation")
 page = st.sidebar.radio("Go to:", ["Overview", "Recommendations", "Analytics"])
@@ -76,10 +117,11 @@ if page == "Overview":
 
     # Dataset Snapshot
     st.subheader("📊 Dataset Snapshot")
-    total_movies = movies_csv['movieId'].nunique()
-    total_users = ratings['userId'].nunique()
-    total_ratings = len(ratings)
-    avg_ratings_per_movie = ratings.groupby('movieId').size().mean()
+    summary = aggregates['summary']
+    total_movies = summary['total_movies']
+    total_users = summary['total_users']
+    total_ratings = summary['total_ratings']
+    avg_ratings_per_movie = summary['avg_ratings_per_movie']
 
     st.metric("Number of Movies", total_movies)
     st.metric("Number of Users", total_users)
@@ -136,28 +178,20 @@ elif page == "Recommendations":
 elif page == "Analytics":
     st.title("Analytics")
     selected_movie_a = st.selectbox("Select a Movie for Analytics:", movie_titles, key='analytics')
-    movie_info = movies[movies['title'] == selected_movie_a].iloc[0]
-    st.markdown(f"**Title:** {movie_info['title'].title()}")
-    st.write(f"Genres: {'|'.join(movie_info['genres']) if isinstance(movie_info['genres'], list) else movie_info['genres']}")
+    selected_row = title_rows[selected_movie_a]
+    st.markdown(f"**Title:** {selected_movie_a.title()}")
+    st.write(f"Genres: {catalog.genres_strs[selected_row]}")
 
     # Map title to movieId
-    movies_csv['title_norm'] = movies_csv['title'].apply(normalize_title)
-    selected_movie_norm = normalize_title(selected_movie_a)
-    try:
-        movie_id = movies_csv.set_index('title_norm').loc[selected_movie_norm, 'movieId']
-    except Exception:
-        movie_id = None
-
-    if movie_id is not None:
-        selected_ratings = ratings[ratings['movieId'] == movie_id]
-    else:
-        selected_ratings = pd.DataFrame()
-
-    if len(selected_ratings) > 0:
-        st.write(f"Number of ratings: {len(selected_ratings)}")
-        st.write(f"Average rating: {selected_ratings['rating'].mean():.2f}")
-        rating_counts = selected_ratings['rating'].value_counts().sort_index()
-        rating_df = pd.DataFrame({'Rating': rating_counts.index, 'Count': rating_counts.values})
+    movie_id = lookup_movie_id(selected_movie_a)
+    selected_stats = stats_for_movie(movie_id)
+
+    if selected_stats is not None and selected_stats['rating_count'] > 0:
+        st.write(f"Number of ratings: {selected_stats['rating_count']}")
+        st.write(f"Average rating: {selected_stats['avg_rating']:.2f}")
+        hist = aggregates['rating_hist'][aggregates['stats_row'][movie_id]]
+        rating_df = pd.DataFrame({'Rating': [(i + 1) / 2 for i in range(len(hist))], 'Count': hist})
+        rating_df = rating_df[rating_df['Count'] > 0]
 
         bar_chart = alt.Chart(rating_df).mark_bar().encode(
             x=alt.X('Rating:O', sort='ascending'),
@@ -166,12 +200,8 @@ elif page == "Analytics":
         ).properties(width=500, height=300, title="Rating Distribution for Selected Movie")
         st.altair_chart(bar_chart, use_container_width=True)
 
-    # Aggregate stats
-    movie_stats = ratings.groupby('movieId').agg(
-        rating_count=('rating', 'count'),
-        avg_rating=('rating', 'mean')
-    ).reset_index()
-    movie_stats = movie_stats.merge(movies_csv[['movieId', 'title']], on='movieId', how='left')
+    # Per-movie aggregates precomputed by analytics_aggregates.py
+    movie_stats = aggregates['rated_stats']
 
     # Rating Counts Comparison
     st.subheader("Rating Counts Comparison")
@@ -203,21 +233,11 @@ elif page == "Analytics":
 
     # Top Rated Movies by Genre
     st.subheader("Top Rated Movies by Genre")
-    all_genres = sorted(set(
-        g for gs in movies['genres'] if isinstance(gs, list) for g in gs if g and g.lower() != "(no genres listed)"
-    ))
+    all_genres = aggregates['summary']['genres']
     selected_genre = st.selectbox("Pick a genre:", all_genres)
-    genre_movies = movies[movies['genres'].apply(lambda gs: selected_genre in gs if isinstance(gs, list) else False)]
-    if not genre_movies.empty:
-        genre_movie_ids = movies_csv[movies_csv['title'].isin(genre_movies['title'])]['movieId']
-        ratings_in_genre = ratings[ratings['movieId'].isin(genre_movie_ids)]
-        genre_stats = ratings_in_genre.groupby('movieId').agg(
-            avg_rating=('rating', 'mean'),
-            rating_count=('rating', 'count')
-        ).reset_index()
-        genre_stats = genre_stats.merge(movies_csv[['movieId', 'title']], on='movieId', how='left')
-        genre_stats = genre_stats[genre_stats['rating_count'] >= 10]
-        top10 = genre_stats.sort_values('avg_rating', ascending=False).head(10)
+    if selected_genre:
+        genre_top = aggregates['genre_top']
+        top10 = genre_top[genre_top['genre'] == selected_genre]
         if len(top10) > 0:
             bar = alt.Chart(top10).mark_bar().encode(
                 x=alt.X('avg_rating:Q', title='Average Rating'),
@@ -230,13 +250,7 @@ elif page == "Analytics":
 
     # Genre Popularity Over Time
     st.subheader("📈 Genre Popularity Over Time")
-    movies_year = movies_csv.copy()
-    movies_year['year'] = movies_year['title'].str.extract(r'\((\d{4})\)').astype(float)
-    movies_year = movies_year.dropna(subset=['year'])
-    movies_year['genres'] = movies_year['genres'].fillna('')
-    movies_year = movies_year.assign(genre=movies_year['genres'].str.split('|')).explode('genre')
-    genre_year_merge = movies_year.merge(ratings, on='movieId', how='inner')
-    genre_trend = genre_year_merge.groupby(['year', 'genre']).size().reset_index(name='count')
+    genre_trend = aggregates['genre_year_counts']
     selected_genre_trend = st.selectbox("Select a genre for trend:", genre_trend['genre'].unique())
     trend_data = genre_trend[genre_trend['genre'] == selected_genre_trend]
     line_chart = alt.Chart(trend_data).mark_line().encode(
@@ -251,13 +265,10 @@ elif page == "Analytics":
     movie1 = st.selectbox("Select first movie:", movie_titles, key="cmp1")
     movie2 = st.selectbox("Select second movie:", movie_titles, key="cmp2")
     def get_movie_stats(title):
-        norm = normalize_title(title)
-        try:
-            mid = movies_csv.set_index('title_norm').loc[norm, 'movieId']
-            r = ratings[ratings['movieId'] == mid]
-            return {"title": title, "count": len(r), "avg": r['rating'].mean() if len(r) > 0 else 0}
-        except Exception:
+        stats = stats_for_movie(lookup_movie_id(title))
+        if stats is None or stats['rating_count'] == 0:
             return {"title": title, "count": 0, "avg": 0}
+        return {"title": title, "count": int(stats['rating_count']), "avg": float(stats['avg_rating'])}
     stats1, stats2 = get_movie_stats(movie1), get_movie_stats(movie2)
     cmp_df = pd.DataFrame([stats1, stats2])
     cmp_chart = alt.Chart(cmp_df).mark_bar().encode(
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from cf_model import _solve_block, solve_factors
+
+
+def solve_rows(matrix, fixed, reg):
+    # The per-row normal-equation solve the batched version replaced
+    out = np.zeros((matrix.shape[0], fixed.shape[1]), dtype=np.float32)
+    eye = np.eye(fixed.shape[1], dtype=np.float64)
+    for row in range(matrix.shape[0]):
+        lo, hi = matrix.indptr[row], matrix.indptr[row + 1]
+        if lo == hi:
+            continue
+        factors = fixed[matrix.indices[lo:hi]].astype(np.float64)
+        a = factors.T @ factors + reg * (hi - lo) * eye
+        b = factors.T @ matrix.data[lo:hi]
+        out[row] = np.linalg.solve(a, b)
+    return out
+
+
+def random_ratings(n_rows, n_cols, seed):
+    # Row lengths from empty to dense, so batches mix very different padding
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(0, n_cols // 2, size=n_rows)
+    lengths[::7] = 0
+    rows = np.repeat(np.arange(n_rows), lengths)
+    cols = np.concatenate([rng.choice(n_cols, length, replace=False) for length in lengths])
+    values = rng.integers(1, 11, size=len(rows)).astype(np.float32) / 2
+    return sparse.csr_matrix((values, (rows, cols)), shape=(n_rows, n_cols), dtype=np.float32)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_solve_factors_matches_per_row_solve(seed):
+    matrix = random_ratings(300, 120, seed)
+    fixed = np.random.default_rng(seed + 100).normal(scale=0.1, size=(120, 16)).astype(np.float32)
+    # Small blocks so rows are split across several threads' blocks
+    batched = solve_factors(matrix, fixed, reg=0.1, n_jobs=2, block_size=64)
+    np.testing.assert_allclose(batched, solve_rows(matrix, fixed, 0.1), rtol=1e-5, atol=1e-6)
+
+
+def test_solve_block_matches_per_row_solve_across_batch_sizes():
+    matrix = random_ratings(200, 80, 3)
+    fixed = np.random.default_rng(4).normal(scale=0.1, size=(80, 8)).astype(np.float32)
+    padded = np.vstack([fixed, np.zeros((1, fixed.shape[1]))]).astype(np.float64)
+    expected = solve_rows(matrix, fixed, 0.5)
+    # From one row per batch up to the whole block in a single batch
+    for max_entries in (1, 64, 1 << 12, 1 << 20):
+        start, out = _solve_block(matrix, padded, 0.5, 0, matrix.shape[0], max_entries)
+        assert start == 0
+        np.testing.assert_allclose(out, expected, rtol=1e-5, atol=1e-6)
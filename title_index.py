@@ -0,0 +1,140 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+
+from data_ingestion import normalize_title
+
+YEAR_PATTERN = re.compile(r'\((\d{4})\)\s*$')
+TRAILING_YEAR_PATTERN = re.compile(r'^(.*\S)\s+(\d{4})$')
+TRAILING_ARTICLE_PATTERN = re.compile(r'^(.*), (the|a|an)$', re.IGNORECASE)
+
+
+def title_key(title):
+    # MovieLens stores "Matrix, The"; move the article back so "the matrix" matches
+    title = title.strip()
+    match = TRAILING_ARTICLE_PATTERN.match(title)
+    if match:
+        title = f"{match.group(2)} {match.group(1)}"
+    return re.sub(r'\s+', ' ', normalize_title(title)).strip()
+
+
+def split_title_year(title):
+    # "Toy Story (1995)" -> ("toy story", 1995); titles without a year get None
+    title = str(title).strip()
+    match = YEAR_PATTERN.search(title)
+    if match:
+        return title_key(title[:match.start()]), int(match.group(1))
+    return title_key(title), None
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    def __init__(self, titles, min_score=0.6):
+        self.min_score = min_score
+        self.years = np.zeros(len(titles), dtype=np.int32)
+        rows_by_key = defaultdict(list)
+        for row, title in enumerate(titles):
+            key, year = split_title_year(title)
+            self.years[row] = year or 0
+            rows_by_key[key].append(row)
+
+        # Sorted unique keys serve prefix lookups with bisect; their ids key the trigram postings
+        self.keys = sorted(rows_by_key)
+        self.key_rows = [np.array(rows_by_key[key], dtype=np.int32) for key in self.keys]
+        self.exact = {key: i for i, key in enumerate(self.keys)}
+
+        postings = defaultdict(list)
+        self.gram_counts = np.zeros(len(self.keys), dtype=np.int32)
+        for i, key in enumerate(self.keys):
+            grams = trigrams(key)
+            self.gram_counts[i] = len(grams)
+            for gram in grams:
+                postings[gram].append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def _pick_row(self, key_id, year):
+        rows = self.key_rows[key_id]
+        if year is None or len(rows) == 1:
+            return int(rows[0])
+        # Duplicate titles: prefer the requested year, else the closest one
+        return int(rows[np.argmin(np.abs(self.years[rows] - year))])
+
+    def _parse(self, title):
+        key, year = split_title_year(title)
+        if year is None and key not in self.exact:
+            # Allow "toy story 1995" as well as "Toy Story (1995)"
+            match = TRAILING_YEAR_PATTERN.match(key)
+            if match and match.group(1) in self.exact:
+                return match.group(1), int(match.group(2))
+        return key, year
+
+    def lookup(self, title):
+        key, year = self._parse(title)
+        key_id = self.exact.get(key)
+        if key_id is None:
+            return None
+        return self._pick_row(key_id, year)
+
+    def fuzzy(self, title, limit=10, min_score=0.0):
+        # Keys with a Dice coefficient of at least min_score, best first. Dice is at most
+        # 2 * overlap / (n_grams + overlap), so keys sharing fewer than min_overlap trigrams are
+        # dropped straight from the counts, before any scoring or sorting
+        key, _ = self._parse(title)
+        n_grams = len(trigrams(key))
+        grams = [self.postings[g] for g in trigrams(key) if g in self.postings]
+        min_overlap = max(1, int(np.ceil(min_score * n_grams / (2 - min_score) - 1e-9)))
+        if len(grams) < min_overlap:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        overlap = np.bincount(np.concatenate(grams), minlength=len(self.keys))
+        candidates = np.flatnonzero(overlap >= min_overlap)
+        # Dice coefficient between trigram sets
+        scores = 2 * overlap[candidates] / (n_grams + self.gram_counts[candidates])
+        keep = scores >= min_score
+        candidates, scores = candidates[keep], scores[keep]
+        best = np.argsort(-scores, kind='stable')[:limit]
+        return candidates[best], scores[best]
+
+    def resolve(self, title):
+        row = self.lookup(title)
+        if row is not None:
+            return row
+        key_ids, scores = self.fuzzy(title, limit=1, min_score=self.min_score)
+        if len(key_ids):
+            return self._pick_row(key_ids[0], self._parse(title)[1])
+        return None
+
+    def prefix(self, title, limit=10):
+        key, _ = split_title_year(title)
+        start = bisect_left(self.keys, key)
+        matches = []
+        for key_id in range(start, len(self.keys)):
+            if len(matches) >= limit or not self.keys[key_id].startswith(key):
+                break
+            matches.append(key_id)
+        return matches
+
+    def search(self, query, limit=10):
+        # Prefix hits rank first, typo-tolerant trigram matches fill the rest
+        results = []
+        seen = set()
+        for key_id in self.prefix(query, limit):
+            results.append((key_id, 1.0))
+            seen.add(key_id)
+        if len(results) < limit:
+            key_ids, scores = self.fuzzy(query, limit, min_score=self.min_score / 2)
+            for key_id, score in zip(key_ids, scores):
+                if len(results) >= limit:
+                    break
+                if key_id not in seen:
+                    results.append((int(key_id), float(score)))
+        matches = []
+        for key_id, score in results:
+            for row in self.key_rows[key_id]:
+                matches.append((int(row), score))
+        return matches[:limit]
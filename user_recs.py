@@ -0,0 +1,113 @@
+import argparse
+import os
+
+import numpy as np
+
+from cf_model import load_cf_artifacts
+from similarity import top_k
+
+
+# Array names of the CF model inside a published artifact version
+CF_ARRAYS = ('cf_user_factors', 'cf_item_factors', 'cf_user_ids', 'cf_movie_ids', 'cf_seen_indptr', 'cf_seen_indices')
+
+
+class UserRecommender:
+    def __init__(self, user_factors, item_factors, user_ids, movie_ids, seen_indptr, seen_indices):
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.user_id_to_idx = {user_id: idx for idx, user_id in enumerate(self.user_ids.tolist())}
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.seen_indptr = seen_indptr
+        self.seen_indices = seen_indices
+
+    @classmethod
+    def from_files(cls, model_dir='models'):
+        user_factors, item_factors, user_ids, movie_ids = load_cf_artifacts(model_dir)
+        return cls(
+            user_factors, item_factors, user_ids, movie_ids,
+            np.load(os.path.join(model_dir, 'seen_indptr.npy'), mmap_mode='r'),
+            np.load(os.path.join(model_dir, 'seen_indices.npy'), mmap_mode='r'),
+        )
+
+    @classmethod
+    def from_artifacts(cls, artifacts):
+        # Memory-mapped from the version directory, so a reload or rollback serves that version's factors
+        return cls(*(artifacts.array(name) for name in CF_ARRAYS))
+
+    def arrays(self):
+        return dict(zip(CF_ARRAYS, (self.user_factors, self.item_factors, self.user_ids, self.movie_ids,
+                                    self.seen_indptr, self.seen_indices)))
+
+    @staticmethod
+    def available(model_dir='models'):
+        return all(
+            os.path.exists(os.path.join(model_dir, name))
+            for name in ('user_factors.pkl', 'item_factors.pkl', 'user_id_map.pkl', 'movie_id_map.pkl', 'seen_indptr.npy')
+        )
+
+    @property
+    def n_items(self):
+        return self.item_factors.shape[0]
+
+    def _mask_seen(self, scores, user_idx):
+        # Expand the CSR rows of this block into (row, col) pairs and knock them out in one assignment
+        starts = self.seen_indptr[user_idx]
+        stops = self.seen_indptr[user_idx + 1]
+        lengths = stops - starts
+        rows = np.repeat(np.arange(len(user_idx)), lengths)
+        cols = np.concatenate([self.seen_indices[a:b] for a, b in zip(starts, stops)]) if len(user_idx) else []
+        scores[rows, cols] = -np.inf
+
+    def score_users(self, user_idx, n, mask=None):
+        # mask is an optional boolean filter over items in this model's item order
+        user_idx = np.asarray(user_idx, dtype=np.int64)
+        scores = self.user_factors[user_idx] @ self.item_factors.T
+        self._mask_seen(scores, user_idx)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        idx = top_k(scores, n)
+        return idx, np.take_along_axis(scores, idx, axis=1)
+
+    def recommend(self, user_id, n=10, mask=None):
+        user_idx = self.user_id_to_idx.get(user_id)
+        if user_idx is None:
+            return None
+        idx, scores = self.score_users([user_idx], n, mask)
+        keep = np.isfinite(scores[0])
+        return self.movie_ids[idx[0][keep]], scores[0][keep]
+
+    def recommend_batch(self, user_ids, n=10, block_size=1024, mask=None):
+        # Score block_size users per matmul so peak memory stays at block_size x n_items floats
+        known = [(user_id, self.user_id_to_idx[user_id]) for user_id in user_ids if user_id in self.user_id_to_idx]
+        for start in range(0, len(known), block_size):
+            block = known[start:start + block_size]
+            idx, scores = self.score_users([user_idx for _, user_idx in block], n, mask)
+            yield [user_id for user_id, _ in block], self.movie_ids[idx], scores
+
+
+def export_user_recommendations(n=20, block_size=1024, out_dir='models/user_recommendations'):
+    recommender = UserRecommender.from_files()
+    os.makedirs(out_dir, exist_ok=True)
+    user_ids = np.array(sorted(recommender.user_id_to_idx), dtype=np.int64)
+    n = min(n, recommender.n_items)
+    # Results stream straight into memmaps so the full table never has to sit in RAM
+    movie_ids = np.lib.format.open_memmap(os.path.join(out_dir, 'movie_ids.npy'), mode='w+', dtype=np.int64, shape=(len(user_ids), n))
+    scores = np.lib.format.open_memmap(os.path.join(out_dir, 'scores.npy'), mode='w+', dtype=np.float32, shape=(len(user_ids), n))
+    np.save(os.path.join(out_dir, 'user_ids.npy'), user_ids)
+    pos = 0
+    for block_users, block_movies, block_scores in recommender.recommend_batch(user_ids.tolist(), n, block_size):
+        movie_ids[pos:pos + len(block_users)] = block_movies
+        scores[pos:pos + len(block_users)] = block_scores
+        pos += len(block_users)
+    movie_ids.flush()
+    scores.flush()
+    print(f"Top-{n} recommendations for {len(user_ids)} users saved to {out_dir}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export top-n recommendations for every user")
+    parser.add_argument('--n', type=int, default=20)
+    parser.add_argument('--block-size', type=int, default=1024)
+    args = parser.parse_args()
+    export_user_recommendations(n=args.n, block_size=args.block_size)